@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+"""
+analysis
+
+Python versions of the summaries in dualverification/ and descriptives/,
+for checking data while it's being collected. Run from the experiment
+directory, e.g., python -m analysis.aggregates.
+"""
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+analysis.aggregates
+
+Running summaries of rt and accuracy that are updated with only the trials
+added since the last update.
+
+    $ python -m analysis.aggregates --data-dir data
+    $ python -m analysis.aggregates --db data/trials.sqlite
+
+For each grouping (subject, proposition, and condition) the aggregates are
+the count, sum and sum of squares of each measure, so adding trials is a
+groupby over the new trials and an add. Trials are cleaned as in clean.R
+before they are counted, and a trial is identified by (subj_id, trial), so
+reading a trial twice doesn't count it twice.
+"""
+import cPickle as pickle
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from unipath import Path
+
+from analysis.clean import clean
+
+GROUPINGS = OrderedDict([
+    ('subj_id', ['subj_id']),
+    ('proposition_id', ['proposition_id']),
+    ('condition', ['feat_type', 'mask_type', 'response_type']),
+])
+MEASURES = ['rt', 'is_correct']
+
+
+def moments(frame, by):
+    """ Trials, timeouts, and n, sum and sum of squares of each measure. """
+    stats = pd.DataFrame(index=frame.index)
+    stats['trials'] = 1
+    stats['timeouts'] = (frame.response == 'timeout').astype(int)
+    for measure in MEASURES:
+        values = frame[measure].astype(float)
+        stats[measure + '_n'] = values.notnull().astype(int)
+        stats[measure + '_sum'] = values.fillna(0)
+        stats[measure + '_sumsq'] = (values ** 2).fillna(0)
+    return stats.groupby([frame[col] for col in by]).sum()
+
+
+def summarize(stats):
+    """ Means and standard deviations from moments. """
+    summary = pd.DataFrame(index=stats.index)
+    summary['trials'] = stats.trials
+    summary['timeouts'] = stats.timeouts
+    for measure in MEASURES:
+        n = stats[measure + '_n'].astype(float)
+        total = stats[measure + '_sum']
+        mean = total / n
+        var = (stats[measure + '_sumsq'] - total * mean) / (n - 1)
+        summary[measure] = mean
+        summary[measure + '_sd'] = np.sqrt(var.clip(lower=0))
+    summary['error'] = 1 - summary.is_correct
+    return summary
+
+
+def z_score(x):
+    return (x - x.mean()) / x.std()
+
+
+class TrialAggregates(object):
+    """ Moments by subject, proposition and condition.
+
+    >>> aggregates = TrialAggregates.load()
+    >>> aggregates.update_from_dir('data')   # reads only new rows
+    >>> aggregates.save()
+    >>> aggregates.summary('condition')
+    >>> aggregates.subjects()   # with z-scores and exclusion flags
+    """
+    STATE = 'aggregates.pickle'
+    # Subjects are flagged if their mean rt or error rate is this many
+    # standard deviations above the other subjects
+    MAX_Z = 2.5
+    MIN_ACCURACY = 0.5
+
+    def __init__(self, state_path=None):
+        self.state_path = state_path or self.STATE
+        self.moments = {name: None for name in GROUPINGS}
+        self.seen = set()     # (subj_id, trial) already counted
+        self.sources = {}     # data file or db -> how far it's been read
+
+    @classmethod
+    def load(cls, state_path=None):
+        state_path = state_path or cls.STATE
+        if os.path.exists(state_path):
+            with open(state_path, 'rb') as f:
+                aggregates = pickle.load(f)
+            aggregates.state_path = state_path
+            return aggregates
+        return cls(state_path)
+
+    def save(self):
+        with open(self.state_path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    def add(self, frame):
+        """ Count trials that haven't been counted yet. """
+        keys = [(str(subj_id), int(trial))
+                for subj_id, trial in zip(frame.subj_id, frame.trial)]
+        is_new = np.array([key not in self.seen for key in keys], dtype=bool)
+        self.seen.update(keys)
+        frame = clean(frame[is_new])
+        if not len(frame):
+            return 0
+        for name, by in GROUPINGS.items():
+            new = moments(frame, by)
+            old = self.moments[name]
+            self.moments[name] = new if old is None else old.add(
+                new, fill_value=0)
+        return len(frame)
+
+    def update_from_dir(self, data_dir):
+        """ Add rows written to csvs in data_dir since the last update. """
+        added = 0
+        for data_file in Path(data_dir).listdir('*.csv'):
+            path = str(data_file)
+            mtime = os.path.getmtime(path)
+            source = self.sources.get(path, dict(mtime=None, rows=0))
+            if source['mtime'] == mtime:
+                continue
+            frame = pd.read_csv(path, skiprows=range(1, source['rows'] + 1))
+            added += self.add(frame)
+            self.sources[path] = dict(mtime=mtime,
+                                      rows=source['rows'] + len(frame))
+        return added
+
+    def update_from_store(self, db_path):
+        """ Add rows inserted into a trial_store database since last time.
+
+        Replaced rows get a new rowid, but are skipped as already seen.
+        """
+        from trial_store import TrialStore, connect
+        last_rowid = self.sources.get(db_path, 0)
+        con = connect(db_path)
+        try:
+            frame = pd.read_sql_query(
+                'SELECT rowid AS _rowid, * FROM %s WHERE rowid > ? '
+                'ORDER BY rowid' % TrialStore.TABLE, con,
+                params=(last_rowid, ))
+        finally:
+            con.close()
+        if not len(frame):
+            return 0
+        self.sources[db_path] = int(frame._rowid.max())
+        return self.add(frame)
+
+    def summary(self, grouping):
+        """ Trials, mean and sd of each measure by a grouping. """
+        return summarize(self.moments[grouping])
+
+    def subjects(self):
+        """ Subject summaries with z-scores across subjects and flags. """
+        subjs = self.summary('subj_id')
+        subjs['rt_z'] = z_score(subjs.rt)
+        subjs['error_z'] = z_score(subjs.error)
+        subjs['slow'] = subjs.rt_z > self.MAX_Z
+        subjs['inaccurate'] = subjs.error_z > self.MAX_Z
+        subjs['below_chance'] = subjs.is_correct < self.MIN_ACCURACY
+        subjs['exclude'] = subjs[['slow', 'inaccurate',
+                                  'below_chance']].any(axis=1)
+        return subjs
+
+    def z_scored_rts(self, frame):
+        """ rt of each cleaned trial z-scored within its subject. """
+        frame = clean(frame)
+        subjs = self.summary('subj_id')
+        mean = frame.subj_id.map(subjs.rt)
+        sd = frame.subj_id.map(subjs.rt_sd)
+        return (frame.rt - mean) / sd
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--db', help='Read a trial_store database instead')
+    parser.add_argument('--state', default=TrialAggregates.STATE)
+    parser.add_argument('--grouping', choices=GROUPINGS.keys(),
+                        default='subj_id')
+
+    args = parser.parse_args()
+
+    aggregates = TrialAggregates.load(args.state)
+    if args.db:
+        added = aggregates.update_from_store(args.db)
+    else:
+        added = aggregates.update_from_dir(args.data_dir)
+    aggregates.save()
+
+    print 'Added %d trials' % added
+    if args.grouping == 'subj_id':
+        print aggregates.subjects().to_string()
+    else:
+        print aggregates.summary(args.grouping).to_string()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+analysis.clean
+
+The cleaning and recoding rules in dualverification/R/clean.R and
+dualverification/R/recode.R.
+"""
+import numpy as np
+
+
+def clean(frame):
+    """ Drop practice trials, rt on errors and accuracy on timeouts. """
+    frame = frame[frame.block_type != 'practice'].copy()
+    is_correct = frame.is_correct.astype(float)
+
+    # Drop RT on incorrect response trials
+    frame['rt'] = frame.rt.astype(float).where(is_correct == 1, np.nan)
+
+    # Drop accuracy on timeout trials
+    frame['is_correct'] = is_correct.where(frame.response != 'timeout',
+                                           np.nan)
+
+    # Create is_error from is_correct
+    frame['is_error'] = 1 - frame.is_correct
+    return frame
+
+
+def recode(frame):
+    """ Add labels and centered codes for feat, mask and response type. """
+    frame = frame.copy()
+    frame['feat_label'] = frame.feat_type.map({
+        'nonvisual': 'Encyclopedic Knowledge',
+        'visual': 'Visual Knowledge',
+    })
+    frame['feat_c'] = frame.feat_type.map({'nonvisual': -0.5, 'visual': 0.5})
+    frame['mask_c'] = frame.mask_type.map({'nomask': -0.5, 'mask': 0.5})
+    frame['response_label'] = frame.response_type.map({
+        'prompt': 'Answer proposition',
+        'pic': 'Verify picture',
+    })
+    frame['response_c'] = frame.response_type.map({'prompt': -0.5,
+                                                   'pic': 0.5})
+
+    # Combine feat_type and mask_type for colors in the plot
+    frame['feat_mask'] = frame.feat_type + ':' + frame.mask_type
+    return frame
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+analysis.dataset
+
+One analysis-ready table: every test trial, cleaned and recoded, joined to
+the ratings of its proposition.
+
+    $ python -m analysis.dataset --data-dir data
+    >>> from analysis.dataset import load_dataset
+    >>> trials = load_dataset('data')
+
+This is what dualverification/data-raw/make.R and the left_join with
+proposition_ratings in results.Rmd do. The table is cached by the sha1 of
+every data file and the ratings csv, one .npy per column, so loading it
+again is a read of a few arrays and it is only rebuilt when an input
+changes. String columns are stored as int codes with their levels.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from unipath import Path
+
+from labtools.stage_cache import file_digest
+
+from analysis.clean import clean, recode
+
+RATINGS = Path('..', 'dualverification', 'data-raw', 'proposition_ratings.csv')
+CACHE_DIR = os.environ.get('DUALVERIFICATION_CACHE', '.dataset_cache')
+
+# Columns the trials already have, so they aren't joined twice
+TRIAL_COLUMNS = ['proposition_id', 'question_slug', 'cue', 'feat_type',
+                 'correct_response']
+
+
+class RatingsIndex(object):
+    """ Position of each proposition's ratings, by proposition_id.
+
+    Four proposition_ids (chair:visual:no:2 and :5, pineapple:visual:no:1
+    and :4) each have two rows of ratings, with different qids. The row
+    whose qid matches the end of the proposition_id is kept, so every
+    trial joins to exactly one row.
+    """
+    def __init__(self, ratings):
+        # qid reads as float, since some are missing
+        qid = ratings.proposition_id.str.split(':').str[-1].astype(float)
+        matches = (qid == ratings.qid).values
+        # Matching qids first, then drop later duplicates
+        order = np.argsort(~matches, kind='mergesort')
+        ratings = ratings.iloc[order]
+        ratings = ratings[~ratings.proposition_id.duplicated()]
+        self.ratings = ratings.reset_index(drop=True)
+        self.keys = pd.Index(self.ratings.proposition_id)
+
+    @classmethod
+    def from_csv(cls, ratings_csv=RATINGS):
+        return cls(pd.read_csv(str(ratings_csv)))
+
+    def positions(self, proposition_ids):
+        """ Row of the ratings for each id, -1 if it wasn't rated. """
+        return self.keys.get_indexer(proposition_ids)
+
+    def join(self, frame):
+        """ frame with the ratings columns of its propositions. """
+        positions = self.positions(frame.proposition_id)
+        rated = positions >= 0
+        frame = frame.copy()
+        for col in self.ratings.columns:
+            if col in TRIAL_COLUMNS:
+                continue
+            values = self.ratings[col].values[positions]
+            if not rated.all():
+                values = pd.Series(values).where(rated, np.nan).values
+            frame[col] = values
+        return frame
+
+
+def data_files(data_dir):
+    return sorted(Path(data_dir).listdir('*.csv'))
+
+
+def input_key(files, ratings_csv=RATINGS):
+    """ A key that changes when any data file or the ratings change. """
+    inputs = dict(data=[(path.name, file_digest(path)) for path in files],
+                  ratings=file_digest(ratings_csv))
+    blob = json.dumps(inputs, sort_keys=True)
+    return 'dataset-%s' % hashlib.sha1(blob).hexdigest()
+
+
+def build(files, ratings_csv=RATINGS):
+    """ Clean, recode and join the trials in files to their ratings. """
+    frame = pd.concat([pd.read_csv(str(path)) for path in files],
+                      ignore_index=True)
+    frame = recode(clean(frame))
+    return RatingsIndex.from_csv(ratings_csv).join(frame).reset_index(
+        drop=True)
+
+
+def write_columns(frame, table_dir):
+    """ Save each column as a .npy in table_dir, replacing it atomically. """
+    parent = Path(table_dir).parent
+    parent.mkdir(parents=True)
+    tmp = tempfile.mkdtemp(dir=str(parent))
+    columns = []
+    for i, col in enumerate(frame.columns):
+        values = frame[col]
+        spec = dict(name=col, file='%03d.npy' % i)
+        if values.dtype == object:
+            codes, levels = pd.factorize(values)
+            spec['levels'] = levels.tolist()
+            values = codes.astype(np.int16)
+        np.save(os.path.join(tmp, spec['file']), np.asarray(values))
+        columns.append(spec)
+    with open(os.path.join(tmp, 'columns.json'), 'w') as f:
+        json.dump(columns, f, indent=2)
+    if os.path.exists(table_dir):
+        shutil.rmtree(table_dir)
+    os.rename(tmp, table_dir)
+
+
+def read_columns(table_dir, columns=None):
+    """ The table saved by write_columns, or only some of its columns. """
+    with open(os.path.join(table_dir, 'columns.json'), 'r') as f:
+        specs = json.load(f)
+    if columns is not None:
+        specs = [spec for spec in specs if spec['name'] in columns]
+    frame = pd.DataFrame()
+    for spec in specs:
+        values = np.load(os.path.join(table_dir, spec['file']))
+        if 'levels' in spec:
+            codes = values
+            values = np.array(spec['levels'] + [np.nan], dtype=object)[codes]
+        frame[spec['name']] = values
+    return frame
+
+
+def load_dataset(data_dir='data', ratings_csv=RATINGS, cache_dir=CACHE_DIR,
+                 columns=None, rebuild=False):
+    """ The analysis table, built only if its inputs changed. """
+    files = data_files(data_dir)
+    table_dir = os.path.join(cache_dir, input_key(files, ratings_csv))
+    if rebuild or not os.path.exists(table_dir):
+        write_columns(build(files, ratings_csv), table_dir)
+    return read_columns(table_dir, columns)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--ratings', default=RATINGS)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--rebuild', action='store_true')
+    parser.add_argument('--output', '-o', help='Also write a csv')
+
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.data_dir, args.ratings, args.cache_dir,
+                           rebuild=args.rebuild)
+    print '%d trials, %d subjects, %d columns' % (
+        len(dataset), dataset.subj_id.nunique(), len(dataset.columns))
+    unrated = dataset.qid.isnull().sum()
+    if unrated:
+        print '%d trials have no ratings' % unrated
+    if args.output:
+        dataset.to_csv(args.output, index=False)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+analysis.power
+
+Simulate cohorts to estimate power for the mask_type x feat_type
+interaction as a function of the number of subjects.
+
+    $ python -m analysis.power --subjects 20 30 40 50 --cohorts 1000 -j 8
+
+Trial lists come from Trials.make, so simulated subjects see the same
+proposition sampling, practice trials and blocking as real ones. A pool of
+lists is made once and each cohort draws its subjects' lists from it.
+Responses come from a model with fixed effects of feat_type, mask_type and
+their interaction, and random intercepts for subjects and propositions.
+Each cohort is analyzed like the data: the interaction is computed per
+subject from cell means of cleaned trials, and tested against 0 with a
+one sample t-test. Results are cached by all of the inputs.
+"""
+import os
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from unipath import Path
+
+from check_trials import make_seeds
+from labtools.stage_cache import StageCache, file_digest
+from trials import Trials
+
+from analysis.resampling import cell_sums, chunk_seeds, interaction
+
+# rt in ms, accuracy on the logit scale. Effects are differences between
+# levels (visual - nonvisual, mask - nomask), and the interaction is the
+# visual mask effect minus the nonvisual mask effect.
+EFFECTS = dict(
+    rt_intercept=650.0,
+    rt_feat=20.0,
+    rt_mask=10.0,
+    rt_interaction=20.0,
+    rt_subj_sd=80.0,
+    rt_item_sd=40.0,
+    rt_sd=150.0,
+    acc_intercept=2.5,
+    acc_feat=0.0,
+    acc_mask=-0.1,
+    acc_interaction=-0.2,
+    acc_subj_sd=0.5,
+    acc_item_sd=0.5,
+    max_wait=1500.0,   # ms, settings.yaml waits: max_wait
+)
+
+CACHE = StageCache(cache_dir=os.environ.get('DUALVERIFICATION_CACHE'))
+
+
+def trial_pool(seeds, jobs=1, **settings):
+    """ Trial lists for seeds as integer-coded arrays. """
+    trials_lists = make_seeds(seeds, jobs, **settings)
+    trials = Trials.concat(trials_lists)
+    items, levels = trials.encoded('proposition_id')
+    lengths = [len(trials_list) for trials_list in trials_lists]
+    return dict(
+        offsets=np.cumsum([0] + lengths),
+        item=items.astype(int),
+        num_items=len(levels),
+        is_visual=(trials.column('feat_type') == 'visual').astype(int),
+        is_mask=(trials.column('mask_type') == 'mask').astype(int),
+        is_test=trials.column('block_type') == 'test',
+    )
+
+
+def simulate_cohort(pool, num_subjects, effects, prng):
+    """ Per subject interactions on rt and errors for one cohort. """
+    offsets = pool['offsets']
+    lists = prng.choice(len(offsets) - 1, num_subjects, replace=False)
+    index = np.concatenate([np.arange(offsets[i], offsets[i+1])
+                            for i in lists])
+    subj = np.repeat(np.arange(num_subjects), np.diff(offsets)[lists])
+
+    # Practice trials are dropped when cleaning
+    test = pool['is_test'][index]
+    index, subj = index[test], subj[test]
+    item = pool['item'][index]
+    is_visual = pool['is_visual'][index]
+    is_mask = pool['is_mask'][index]
+    feat_c = is_visual - 0.5
+    mask_c = is_mask - 0.5
+
+    def predictor(prefix):
+        subj_effects = prng.normal(0, effects[prefix + '_subj_sd'],
+                                   num_subjects)
+        item_effects = prng.normal(0, effects[prefix + '_item_sd'],
+                                   pool['num_items'])
+        return (effects[prefix + '_intercept'] +
+                effects[prefix + '_feat'] * feat_c +
+                effects[prefix + '_mask'] * mask_c +
+                effects[prefix + '_interaction'] * feat_c * mask_c +
+                subj_effects[subj] + item_effects[item])
+
+    rt = predictor('rt') + prng.normal(0, effects['rt_sd'], len(index))
+    is_correct = prng.rand(len(index)) < 1 / (1 + np.exp(-predictor('acc')))
+    timeout = rt > effects['max_wait']
+
+    # Cleaned as in clean.R
+    rt = np.where(is_correct & ~timeout, rt, np.nan)
+    is_error = np.where(timeout, np.nan, 1.0 - is_correct)
+
+    results = []
+    for values in [rt, is_error]:
+        keep = ~np.isnan(values)
+        sums, counts = cell_sums(subj[keep], is_visual[keep], is_mask[keep],
+                                 values[keep], num_subjects)
+        results.append(interaction(sums, counts))
+    return results
+
+
+def one_sample_t(effects):
+    """ Mean, t and two-sided p of per-subject effects. """
+    effects = effects[~np.isnan(effects)]
+    mean = effects.mean()
+    t = mean / (effects.std(ddof=1) / np.sqrt(len(effects)))
+    return mean, t, 2 * stats.t.sf(abs(t), len(effects) - 1)
+
+
+def _simulate_chunk(chunk, pool, num_subjects, effects):
+    seed, size = chunk
+    prng = np.random.RandomState(seed)
+    rows = []
+    for _ in xrange(size):
+        rt, error = simulate_cohort(pool, num_subjects, effects, prng)
+        rows.append(one_sample_t(rt) + one_sample_t(error))
+    return rows
+
+
+def simulate(pool, num_subjects, cohorts=1000, effects=None, jobs=1,
+             seed=None, chunk_size=50):
+    """ Mean, t and p for rt and errors in each simulated cohort. """
+    effects = dict(EFFECTS, **(effects or {}))
+    run_chunk = partial(_simulate_chunk, pool=pool,
+                        num_subjects=num_subjects, effects=effects)
+    chunks = chunk_seeds(seed, cohorts, chunk_size)
+    if jobs > 1:
+        from multiprocessing import Pool
+        workers = Pool(jobs)
+        try:
+            results = workers.map(run_chunk, chunks)
+        finally:
+            workers.close()
+    else:
+        results = map(run_chunk, chunks)
+    return pd.DataFrame(sum(results, []),
+                        columns=['rt_effect', 'rt_t', 'rt_p',
+                                 'error_effect', 'error_t', 'error_p'])
+
+
+def power_curve(subject_counts, seeds, cohorts=1000, effects=None,
+                alpha=0.05, jobs=1, seed=None, cache=CACHE, **settings):
+    """ Power for rt and errors at each number of subjects.
+
+    Trial lists are made for seeds, which needs at least as many seeds as
+    the largest number of subjects.
+    """
+    effects = dict(EFFECTS, **(effects or {}))
+    assert len(seeds) >= max(subject_counts), 'need a list per subject'
+    propositions = file_digest(Path(Trials.STIM_DIR, 'propositions.csv'))
+
+    pool = []
+
+    def run(num_subjects):
+        if not pool:
+            pool.append(trial_pool(seeds, jobs, **settings))
+        sims = simulate(pool[0], num_subjects, cohorts, effects, jobs, seed)
+        return dict(subjects=num_subjects,
+                    rt_effect=sims.rt_effect.mean(),
+                    rt_power=(sims.rt_p < alpha).mean(),
+                    error_effect=sims.error_effect.mean(),
+                    error_power=(sims.error_p < alpha).mean())
+
+    rows = []
+    for num_subjects in subject_counts:
+        if cache is None:
+            rows.append(run(num_subjects))
+            continue
+        key = cache.key('power', subjects=num_subjects, seeds=list(seeds),
+                        cohorts=cohorts, effects=effects, alpha=alpha,
+                        seed=seed, settings=settings,
+                        propositions=propositions)
+        rows.append(cache.get(key, run, num_subjects))
+    return pd.DataFrame(rows, columns=['subjects', 'rt_effect', 'rt_power',
+                                       'error_effect', 'error_power'])
+
+
+def _effect(arg):
+    name, value = arg.split('=')
+    if name not in EFFECTS:
+        raise ValueError('unknown effect %s' % name)
+    return name, float(value)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subjects', type=int, nargs='+',
+                        default=[20, 30, 40, 50, 60])
+    parser.add_argument('--cohorts', type=int, default=1000)
+    parser.add_argument('--lists', type=int, default=200,
+                        help='Number of trial lists to draw subjects from')
+    parser.add_argument('--effect', type=_effect, action='append',
+                        default=[], metavar='NAME=VALUE',
+                        help='Override an effect, e.g., rt_interaction=15')
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--jobs', '-j', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+
+    args = parser.parse_args()
+
+    seeds = range(1, max(args.lists, max(args.subjects)) + 1)
+    curve = power_curve(args.subjects, seeds, args.cohorts,
+                        dict(args.effect), args.alpha, args.jobs, args.seed)
+    print curve.to_string(index=False)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+analysis.resampling
+
+Bootstrap and permutation tests of the mask_type x feat_type interaction:
+how much more the mask slows (or hurts accuracy on) visual propositions
+than nonvisual ones.
+
+    $ python -m analysis.resampling --measure rt --cluster subject -n 20000
+
+Trials are reduced once to sums and counts per cluster (subject or
+proposition) in each of the four feat_type x mask_type cells. A resample is
+then a vector of weights over clusters, so a chunk of resamples is one
+matrix product. Chunks are run on a process pool. Each chunk gets its own
+seed drawn from the main seed, so results don't depend on the number of
+jobs.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from unipath import Path
+
+from analysis.clean import clean
+
+# cell = 2 * is_visual + is_mask
+NUM_CELLS = 4
+
+Clusters = namedtuple('Clusters', ['labels', 'sums', 'counts', 'is_visual'])
+
+
+def cluster_cells(frame, measure='rt', cluster='subject'):
+    """ Sums and counts of measure per cluster in each cell.
+
+    frame is cleaned trials. cluster is 'subject' or 'item'.
+    """
+    frame = frame[frame[measure].notnull()]
+    col = dict(subject='subj_id', item='proposition_id')[cluster]
+    codes, labels = pd.factorize(frame[col])
+    is_visual = (frame.feat_type == 'visual').values.astype(int)
+    is_mask = (frame.mask_type == 'mask').values.astype(int)
+    sums, counts = cell_sums(codes, is_visual, is_mask,
+                             frame[measure].values.astype(float), len(labels))
+    # Propositions are either visual or nonvisual
+    cluster_visual = np.bincount(codes, weights=is_visual) > 0
+    return Clusters(labels, sums, counts, cluster_visual)
+
+
+def cell_sums(codes, is_visual, is_mask, values, num_clusters):
+    """ (clusters, cells) arrays of the sums and counts of values. """
+    bins = codes * NUM_CELLS + 2 * is_visual + is_mask
+    size = num_clusters * NUM_CELLS
+    sums = np.bincount(bins, weights=values, minlength=size)
+    counts = np.bincount(bins, minlength=size).astype(float)
+    return sums.reshape(-1, NUM_CELLS), counts.reshape(-1, NUM_CELLS)
+
+
+def interaction(sums, counts):
+    """ (visual mask effect) - (nonvisual mask effect) over the last axis. """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    nonvisual = means[..., 1] - means[..., 0]
+    visual = means[..., 3] - means[..., 2]
+    return visual - nonvisual
+
+
+def chunk_seeds(seed, n, chunk_size):
+    """ (seed, size) for each chunk of n resamples. """
+    sizes = [chunk_size] * (n // chunk_size)
+    if n % chunk_size:
+        sizes.append(n % chunk_size)
+    seeds = np.random.RandomState(seed).randint(2**31 - 1, size=len(sizes))
+    return zip(seeds, sizes)
+
+
+def _bootstrap_chunk(args):
+    (seed, size), clusters = args
+    prng = np.random.RandomState(seed)
+    num_clusters = len(clusters.sums)
+    # Times each cluster is drawn in each resample
+    weights = prng.multinomial(num_clusters, [1.0 / num_clusters] *
+                               num_clusters, size=size)
+    return interaction(weights.dot(clusters.sums),
+                       weights.dot(clusters.counts))
+
+
+def _subject_permutation_chunk(args):
+    (seed, size), effects = args
+    prng = np.random.RandomState(seed)
+    signs = prng.randint(2, size=(size, len(effects))) * 2 - 1
+    return signs.dot(effects) / float(len(effects))
+
+
+def _item_permutation_chunk(args):
+    (seed, size), (effects, is_visual) = args
+    prng = np.random.RandomState(seed)
+    order = np.argsort(prng.rand(size, len(effects)), axis=1)
+    visual = is_visual[order].astype(float)
+    num_visual = is_visual.sum()
+    return (visual.dot(effects) / num_visual -
+            (1 - visual).dot(effects) / (len(effects) - num_visual))
+
+
+def _run(chunk_func, data, n, chunk_size, jobs, seed):
+    tasks = [(chunk, data) for chunk in chunk_seeds(seed, n, chunk_size)]
+    if jobs > 1:
+        from multiprocessing import Pool
+        pool = Pool(jobs)
+        try:
+            results = pool.map(chunk_func, tasks)
+        finally:
+            pool.close()
+    else:
+        results = map(chunk_func, tasks)
+    return np.concatenate(results)
+
+
+def bootstrap(frame, measure='rt', cluster='subject', n=10000,
+              chunk_size=1000, jobs=1, seed=None):
+    """ Cluster bootstrap distribution of the interaction. """
+    clusters = cluster_cells(frame, measure, cluster)
+    return _run(_bootstrap_chunk, clusters, n, chunk_size, jobs, seed)
+
+
+def permutation_test(frame, measure='rt', cluster='subject', n=10000,
+                     chunk_size=1000, jobs=1, seed=None):
+    """ Observed interaction, its null distribution and a two-sided p.
+
+    By subject, the observed value is the mean of the subjects'
+    interactions, and the sign of each is flipped at random. By item, the
+    mask effect of each proposition is computed and the visual/nonvisual
+    labels are shuffled across propositions.
+    """
+    clusters = cluster_cells(frame, measure, cluster)
+    if cluster == 'subject':
+        effects = interaction(clusters.sums, clusters.counts)
+        effects = effects[~np.isnan(effects)]
+        observed = effects.mean()
+        null = _run(_subject_permutation_chunk, effects, n, chunk_size,
+                    jobs, seed)
+    else:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = clusters.sums / clusters.counts
+        # Mask effect per proposition, in the cells of its feat_type
+        effects = np.where(clusters.is_visual, means[:, 3] - means[:, 2],
+                           means[:, 1] - means[:, 0])
+        complete = ~np.isnan(effects)
+        effects = effects[complete]
+        is_visual = clusters.is_visual[complete]
+        observed = (effects[is_visual].mean() -
+                    effects[~is_visual].mean())
+        null = _run(_item_permutation_chunk, (effects, is_visual), n,
+                    chunk_size, jobs, seed)
+    p = (np.sum(np.abs(null) >= abs(observed)) + 1) / float(len(null) + 1)
+    return observed, null, p
+
+
+def percentile_interval(stats, level=0.95):
+    tail = 100 * (1 - level) / 2
+    return np.percentile(stats, [tail, 100 - tail])
+
+
+def load_trials(data_dir='data'):
+    """ Cleaned trials from every csv in data_dir. """
+    frames = [pd.read_csv(str(path))
+              for path in Path(data_dir).listdir('*.csv')]
+    return clean(pd.concat(frames, ignore_index=True))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--measure', choices=['rt', 'is_error'],
+                        default='rt')
+    parser.add_argument('--cluster', choices=['subject', 'item'],
+                        default='subject')
+    parser.add_argument('-n', type=int, default=10000)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--jobs', '-j', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+
+    args = parser.parse_args()
+
+    trials = load_trials(args.data_dir)
+    kwargs = dict(measure=args.measure, cluster=args.cluster, n=args.n,
+                  chunk_size=args.chunk_size, jobs=args.jobs, seed=args.seed)
+    stats = bootstrap(trials, **kwargs)
+    observed, null, p = permutation_test(trials, **kwargs)
+    low, high = percentile_interval(stats)
+    print 'mask x feat_type interaction on %s, by %s' % (args.measure,
+                                                         args.cluster)
+    print 'observed: %.3f' % observed
+    print '95%% bootstrap interval: [%.3f, %.3f]' % (low, high)
+    print 'permutation p: %.4f' % p
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from analysis.dataset import RATINGS, RatingsIndex
+
+DUPLICATED = ['chair:visual:no:2', 'chair:visual:no:5',
+              'pineapple:visual:no:1', 'pineapple:visual:no:4']
+
+
+def test_duplicated_ratings_keep_the_matching_qid():
+    ratings = pd.read_csv(str(RATINGS))
+    counts = ratings.proposition_id.value_counts()
+    assert sorted(counts[counts > 1].index) == DUPLICATED
+
+    index = RatingsIndex(ratings)
+    assert index.keys.is_unique
+    assert len(index.ratings) == ratings.proposition_id.nunique()
+    kept = index.ratings.set_index('proposition_id').qid
+    for proposition_id in DUPLICATED:
+        assert kept[proposition_id] == int(proposition_id.split(':')[-1])
+
+
+def test_match_wins_regardless_of_row_order():
+    ratings = pd.DataFrame(dict(proposition_id=['a:visual:no:1'] * 2,
+                                qid=[4, 1], imagery_mean=[0.0, 3.2]))
+    index = RatingsIndex(ratings)
+    assert index.ratings.imagery_mean.tolist() == [3.2]
+
+
+def test_match_wins_when_qids_are_floats():
+    # A missing qid makes the column float
+    ratings = pd.DataFrame(dict(
+        proposition_id=['a:visual:no:1', 'a:visual:no:1', 'b:visual:no:2'],
+        qid=[4.0, 1.0, np.nan], imagery_mean=[0.0, 3.2, 1.0]))
+    index = RatingsIndex(ratings)
+    assert index.ratings.imagery_mean.tolist() == [3.2, 1.0]
+
+
+def test_join_adds_one_row_of_ratings_per_trial():
+    index = RatingsIndex.from_csv()
+    trials = pd.DataFrame(dict(
+        proposition_id=DUPLICATED + ['not:a:proposition:0'],
+        rt=np.arange(5.0)))
+    joined = index.join(trials)
+    assert len(joined) == len(trials)
+    assert joined.qid[:4].tolist() == [2, 5, 1, 4]
+    assert np.isnan(joined.qid.iloc[4])
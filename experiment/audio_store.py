@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+""" Keep every question and cue as int16 samples at their own rate.
+
+A psychopy Sound keeps its own float copy of its samples, resampled to the
+audio server's rate, so loading the whole stimulus bank as Sounds costs
+several times the size of the wavs. AudioStore keeps each clip as int16 at
+the rate it was recorded at, and only resamples and creates Sounds for the
+few clips that are about to play.
+
+    >>> store = AudioStore.from_files('stimuli', ['questions', 'cues'])
+    >>> store.duration('questions/is-it-long')  # no decoding
+    1.07
+    >>> store.make_sound = lambda samples, rate: sound.Sound(
+    ...     value=samples, sampleRate=rate)
+    >>> questions = store.sounds('questions')
+    >>> questions['is-it-long'].play()
+
+Decoded clips are packed into one contiguous buffer. Clips from a
+SessionBundle stay views into the memory-mapped bundle.
+"""
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from unipath import Path
+
+from bundle import DecodedStimuli, SessionBundle, to_sound
+
+# pcm is flat, interleaved int16
+Clip = namedtuple('Clip', ['pcm', 'channels', 'sample_rate'])
+
+
+def pack(clips):
+    """ Copy the samples of clips into one contiguous int16 buffer. """
+    samples = np.empty(sum(len(clip.pcm) for clip in clips.values()),
+                       dtype='<i2')
+    packed = {}
+    offset = 0
+    for key, clip in sorted(clips.items()):
+        pcm = samples[offset:offset+len(clip.pcm)]
+        pcm[:] = clip.pcm
+        packed[key] = clip._replace(pcm=pcm)
+        offset += len(pcm)
+    return packed
+
+
+class StoredSound(object):
+    """ A clip in an AudioStore, created as a Sound when it's needed.
+
+    Call load() ahead of time, e.g., when preparing a trial, so that
+    play() doesn't have to create the Sound.
+    """
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def getDuration(self):
+        return self.store.duration(self.key)
+
+    def load(self):
+        return self.store.live_sound(self.key)
+
+    def play(self):
+        self.load().play()
+
+    def stop(self):
+        if self.key in self.store.live:
+            self.store.live[self.key].stop()
+
+
+class AudioStore(object):
+    def __init__(self, clips, make_sound=None, max_live=4):
+        self.clips = clips       # key -> Clip
+        self.make_sound = make_sound
+        self.max_live = max_live
+        self.live = OrderedDict()
+
+    @classmethod
+    def from_stimuli(cls, stimuli, kinds, **kwargs):
+        """ Clips from a SessionBundle or DecodedStimuli.
+
+        A SessionBundle is already one buffer, so its clips are views into
+        it. Decoded clips are packed into one buffer.
+        """
+        clips = {}
+        for kind in kinds:
+            for name in stimuli.keys(kind):
+                key = kind + '/' + name
+                pcm, meta = stimuli.pcm(key)
+                clips[key] = Clip(pcm, meta['channels'], meta['sample_rate'])
+        if not isinstance(stimuli, SessionBundle):
+            clips = pack(clips)
+        return cls(clips, **kwargs)
+
+    @classmethod
+    def from_files(cls, stim_dir, kinds, **kwargs):
+        """ Decode the wavs in each stim_dir/kind into one buffer. """
+        files = [(kind + '/' + path.stem, path) for kind in kinds
+                 for path in Path(stim_dir, kind).listdir('*.wav')]
+        return cls.from_stimuli(DecodedStimuli(files), kinds, **kwargs)
+
+    def keys(self, kind):
+        prefix = kind + '/'
+        return [key[len(prefix):] for key in self.clips
+                if key.startswith(prefix)]
+
+    def duration(self, key):
+        clip = self.clips[key]
+        return len(clip.pcm) / float(clip.channels * clip.sample_rate)
+
+    def pcm(self, key):
+        """ int16 samples, shaped (frames, channels) if not mono. """
+        clip = self.clips[key]
+        if clip.channels > 1:
+            return clip.pcm.reshape(-1, clip.channels)
+        return clip.pcm
+
+    def floats(self, key):
+        """ Samples as floats in [-1, 1] at the clip's own rate. """
+        return self.pcm(key) / 32768.0
+
+    @property
+    def nbytes(self):
+        return sum(clip.pcm.nbytes for clip in self.clips.values())
+
+    def live_sound(self, key):
+        """ A Sound for key, keeping the max_live most recently used.
+
+        Sounds are made at the audio server's rate.
+        """
+        if key in self.live:
+            self.live[key] = self.live.pop(key)
+        else:
+            self.live[key] = self.make_sound(*to_sound(*self.clips[key]))
+            while len(self.live) > self.max_live:
+                self.live.popitem(last=False)
+        return self.live[key]
+
+    def sounds(self, kind):
+        """ StoredSounds for every clip of a kind, by name. """
+        return {name: StoredSound(self, kind + '/' + name)
+                for name in self.keys(kind)}
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+""" Benchmarks for trial generation and session throughput.
+
+    $ python benchmark.py run -o before.json
+    $ python benchmark.py run -o after.json
+    $ python benchmark.py compare before.json after.json
+
+Each benchmark is a function that does its setup and returns a callable.
+Only the callable is timed.
+"""
+import argparse
+import json
+import subprocess
+import tempfile
+import time
+import timeit
+import wave
+from collections import OrderedDict
+
+import numpy as np
+from unipath import Path
+
+from labtools import trials_functions
+from labtools import generator_functions
+from labtools.stage_cache import StageCache
+
+from audio_store import AudioStore
+from participant import Participant
+from trials import Trials
+
+BENCHMARKS = OrderedDict()
+SCALES = [1, 4, 16]
+
+
+def benchmark(name, repeat=5):
+    """ Register a benchmark under name. """
+    def register(setup):
+        BENCHMARKS[name] = (setup, repeat)
+        return setup
+    return register
+
+
+def scaled(name, repeat=5):
+    """ Register a benchmark once for each design scale in SCALES. """
+    def register(setup):
+        for scale in SCALES:
+            bench_name = '{}[x{}]'.format(name, scale)
+            BENCHMARKS[bench_name] = (lambda s=scale: setup(s), repeat)
+        return setup
+    return register
+
+
+def design(scale):
+    """ The Trials.make skeleton with scale times as many reps. """
+    trials = trials_functions.counterbalance(
+        {'feat_type': ['visual', 'nonvisual'], 'mask_type': ['mask', 'nomask']})
+    trials = trials_functions.expand(trials, name='correct_response',
+                                     values=['yes', 'no'], ratio=0.75, seed=1)
+    trials = trials_functions.expand(trials, name='response_type',
+                                     values=['prompt', 'pic'], ratio=0.75,
+                                     seed=1)
+    trials = trials_functions.extend(trials, reps=4*scale)
+    categories = Trials.propositions().cue.unique()
+    trials['cue'] = np.random.RandomState(1).choice(categories, len(trials))
+    return trials
+
+
+# Trials.make
+# -----------
+
+@benchmark('Trials.make[10 seeds]', repeat=3)
+def bench_trials_make():
+    return lambda: [Trials.make(seed=seed, cache=None) for seed in range(10)]
+
+
+@benchmark('Trials.make[10 seeds, new block size]', repeat=3)
+def bench_trials_make_cached():
+    cache = StageCache()
+    for seed in range(10):
+        Trials.make(seed=seed, cache=cache)
+    return lambda: [Trials.make(seed=seed, block_size=40, cache=cache)
+                    for seed in range(10)]
+
+
+# trials_functions
+# ----------------
+
+@scaled('trials_functions.counterbalance')
+def bench_counterbalance(scale):
+    conditions = {'factor_%d' % i: range(2) for i in range(2 + scale/4)}
+    conditions['cue'] = range(scale * 4)
+    return lambda: trials_functions.counterbalance(dict(conditions))
+
+
+@scaled('trials_functions.expand')
+def bench_expand(scale):
+    frame = design(scale)
+    return lambda: trials_functions.expand(frame, name='x', values=['a', 'b'],
+                                           ratio=0.75, seed=1)
+
+
+@scaled('trials_functions.extend')
+def bench_extend(scale):
+    frame = design(1)
+    return lambda: trials_functions.extend(frame, reps=4*scale)
+
+
+@scaled('trials_functions.add_block')
+def bench_add_block(scale):
+    frame = design(scale)
+    return lambda: trials_functions.add_block(frame.copy(), 50, groupby='cue',
+                                              seed=1)
+
+
+@scaled('trials_functions.smart_shuffle', repeat=3)
+def bench_smart_shuffle(scale):
+    frame = trials_functions.add_block(design(scale), 50, groupby='cue',
+                                       seed=1)
+    return lambda: trials_functions.smart_shuffle(frame, col='cue',
+                                                  block='block', seed=1,
+                                                  verbose=False)
+
+
+@scaled('trials_functions.simple_shuffle')
+def bench_simple_shuffle(scale):
+    frame = trials_functions.add_block(design(scale), 50, seed=1)
+    return lambda: trials_functions.simple_shuffle(frame, block='block',
+                                                   seed=1)
+
+
+# generator_functions
+# -------------------
+
+@scaled('generator_functions.generate', repeat=3)
+def bench_generate(scale):
+    frame = design(scale)
+    source = Trials.propositions()[['question_slug']]
+    return lambda: generator_functions.generate(frame.copy(), source, seed=1)
+
+
+@scaled('generator_functions.generate_matches', repeat=3)
+def bench_generate_matches(scale):
+    frame = design(scale)
+    source = Trials.propositions()[['cue', 'question_slug']]
+    return lambda: generator_functions.generate_matches(
+        frame.copy(), source, on='cue', cols='question_slug', seed=1)
+
+
+@scaled('generator_functions.generate_but_not', repeat=3)
+def bench_generate_but_not(scale):
+    frame = design(scale)
+    source = Trials.propositions()[['cue', 'question_slug']]
+    return lambda: generator_functions.generate_but_not(
+        frame.copy(), source, on='cue', cols='question_slug', seed=1)
+
+
+# Sessions
+# --------
+
+def simulate_responses(trials, seed=None):
+    """ Fill in response columns as if a participant had responded. """
+    prng = np.random.RandomState(seed)
+    for trial in trials:
+        trial['response'] = prng.choice(['yes', 'no', 'timeout'],
+                                        p=[0.48, 0.48, 0.04])
+        trial['rt'] = prng.uniform(300, 1500)
+        trial['is_correct'] = int(trial['response'] ==
+                                  trial['correct_response'])
+    return trials
+
+
+def run_headless_session(trials, data_dir, subj_id='BENCH'):
+    """ Write every trial of a session as main() would. """
+    participant = Participant(subj_id=subj_id, seed=0,
+                              _order=['subj_id', 'seed'])
+    participant.DATA_DIR = data_dir
+    participant.write_header(trials.COLUMNS)
+    for block in trials.iter_blocks():
+        for trial in block:
+            participant.write_trial(trial)
+    return participant
+
+
+@benchmark('Participant.write_trial[1 session]')
+def bench_write_trial():
+    trials = simulate_responses(Trials.make(seed=1), seed=1)
+    tmp = tempfile.mkdtemp()
+    counter = iter(xrange(10**6))
+
+    def _run():
+        run_headless_session(trials, tmp, subj_id=next(counter))
+    return _run
+
+
+@benchmark('session[headless]', repeat=3)
+def bench_headless_session():
+    tmp = tempfile.mkdtemp()
+    counter = iter(xrange(10**6))
+
+    def _run():
+        n = next(counter)
+        trials = simulate_responses(Trials.make(seed=n), seed=n)
+        run_headless_session(trials, tmp, subj_id=n)
+    return _run
+
+
+# Stimuli
+# -------
+
+@benchmark('stimuli.decode_wavs', repeat=3)
+def bench_decode_wavs():
+    wavs = (Path('stimuli', 'questions').listdir('*.wav') +
+            Path('stimuli', 'cues').listdir('*.wav'))
+
+    def _run():
+        for wav in wavs:
+            f = wave.open(str(wav), 'rb')
+            f.readframes(f.getnframes())
+            f.close()
+    return _run
+
+
+@benchmark('stimuli.load_sounds', repeat=3)
+def bench_load_sounds():
+    try:
+        from labtools.psychopy_helper import load_sounds
+    except ImportError:
+        return None
+    return lambda: load_sounds(Path('stimuli', 'questions'))
+
+
+@benchmark('stimuli.audio_store', repeat=3)
+def bench_audio_store():
+    return lambda: AudioStore.from_files('stimuli', ['questions', 'cues'])
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short',
+                                        'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(pattern=None):
+    """ Time all benchmarks with names containing pattern. """
+    results = OrderedDict()
+    for name, (setup, repeat) in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        func = setup()
+        if func is None:
+            print '{:<45} skipped'.format(name)
+            continue
+        times = timeit.repeat(func, number=1, repeat=repeat)
+        results[name] = dict(min=min(times), median=float(np.median(times)),
+                             mean=float(np.mean(times)), repeat=repeat)
+        print '{:<45} {:>10.4f}s'.format(name, results[name]['median'])
+    return dict(commit=git_commit(), date=time.strftime('%Y-%m-%d %H:%M'),
+                results=results)
+
+
+def compare(before, after, threshold=1.2):
+    """ Compare median times between two result files.
+
+    Returns the names of benchmarks that got slower by more than threshold.
+    """
+    regressions = []
+    print '{:<45} {:>10} {:>10} {:>7}'.format('benchmark', before['commit'],
+                                              after['commit'], 'ratio')
+    for name, new in after['results'].items():
+        if name not in before['results']:
+            continue
+        old = before['results'][name]
+        ratio = new['median'] / old['median']
+        flag = ''
+        if ratio > threshold:
+            flag = ' !'
+            regressions.append(name)
+        print '{:<45} {:>10.4f} {:>10.4f} {:>7.2f}{}'.format(
+            name, old['median'], new['median'], ratio, flag)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['run', 'compare', 'list'])
+    parser.add_argument('results', nargs='*',
+                        help='Result files to compare: before after')
+    parser.add_argument('--output', '-o', help='Name of output file')
+    parser.add_argument('-k', dest='pattern',
+                        help='Only run benchmarks containing this string')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Slowdown ratio to flag as a regression')
+
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for name in BENCHMARKS:
+            print name
+    elif args.command == 'run':
+        results = run(args.pattern)
+        output = args.output or 'benchmark-{}.json'.format(results['commit'])
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        before_json, after_json = args.results
+        with open(before_json) as f:
+            before = json.load(f)
+        with open(after_json) as f:
+            after = json.load(f)
+        regressions = compare(before, after, args.threshold)
+        if regressions:
+            raise SystemExit(1)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+""" Precompiled session bundles.
+
+A bundle holds a participant's finished trial list and the decoded audio and
+image data for every stimulus the session uses, so a session can start
+without generating trials or reading stimulus files.
+
+    $ python run.py compile --subj-info '{"subj_id": "MDT146", "seed": 146}'
+    $ python run.py --bundle bundles/MDT146.bundle
+
+Layout::
+
+    MAGIC | header length (uint32) | json header | trial codes | payloads
+
+The trial table is stored as one int16 code per cell, with the levels of
+each column in the header. Payloads are raw pcm samples (wav) and raw RGB
+pixels (images), each aligned to 16 bytes, located by the offsets in the
+header. Audio is stored at each file's own rate and resampled to
+SAMPLE_RATE when a sound is made from it, because sounds created from
+arrays play at the audio server's rate. SessionBundle memory-maps the file
+and returns views into it.
+"""
+import json
+import mmap
+import struct
+import wave
+
+import numpy as np
+from PIL import Image
+from unipath import Path
+
+from trials import Trials
+
+MAGIC = 'DVBUNDLE1\n'
+ALIGN = 16
+STIM_DIR = Path('stimuli')
+BUNDLE_DIR = Path('bundles')
+SAMPLE_RATE = 48000   # run.py initializes sound at 48000
+
+
+def referenced_stimuli(trials, stim_dir=STIM_DIR):
+    """ (key, path) for every stimulus file the session can present. """
+    stimuli = []
+    for slug in sorted(set(trial['question_slug'] for trial in trials)):
+        stimuli.append(('questions/' + slug,
+                        Path(stim_dir, 'questions', slug + '.wav')))
+    for cue in sorted(set(trial['cue'] for trial in trials)):
+        stimuli.append(('cues/' + cue, Path(stim_dir, 'cues', cue + '.wav')))
+    # The apple is shown in the instructions
+    pics = set(trial['pic'] for trial in trials if trial['pic']) | {'apple'}
+    for pic in sorted(pics):
+        stimuli.append(('pics/' + pic, Path(stim_dir, 'pics', pic + '.bmp')))
+    for dirname, match in [('dynamic_mask', '*.png'), ('feedback', '*.wav')]:
+        for path in Path(stim_dir, dirname).listdir(match):
+            stimuli.append((dirname + '/' + path.stem, path))
+    return stimuli
+
+
+def resample(samples, from_rate, to_rate):
+    """ Linearly interpolate int16 samples shaped (frames, channels). """
+    if from_rate == to_rate:
+        return samples
+    num_frames = int(round(len(samples) * float(to_rate) / from_rate))
+    old_t = np.arange(len(samples)) / float(from_rate)
+    new_t = np.arange(num_frames) / float(to_rate)
+    resampled = [np.interp(new_t, old_t, samples[:, c])
+                 for c in range(samples.shape[1])]
+    return np.round(np.column_stack(resampled)).astype('<i2')
+
+
+def decode(path, sample_rate=None):
+    """ Raw bytes and metadata for a stimulus file.
+
+    Audio keeps the file's sample rate unless sample_rate is given.
+    """
+    if path.ext == '.wav':
+        f = wave.open(str(path), 'rb')
+        assert f.getsampwidth() == 2, '%s is not 16-bit' % path
+        channels = f.getnchannels()
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+        if sample_rate is None:
+            sample_rate = f.getframerate()
+        samples = resample(samples.reshape(-1, channels), f.getframerate(),
+                           sample_rate)
+        f.close()
+        meta = dict(kind='sound', sample_rate=sample_rate, channels=channels)
+        data = samples.tobytes()
+    else:
+        image = Image.open(str(path)).convert('RGB')
+        meta = dict(kind='image', size=list(image.size))
+        data = image.tobytes()
+    return data, meta
+
+
+def encode_trials(trials, columns):
+    """ int16 codes for each cell and the levels of each column. """
+    levels = {}
+    codes = np.empty((len(trials), len(columns)), dtype='<i2')
+    for j, col in enumerate(columns):
+        codes[:, j], col_levels = trials.encoded(col)
+        # numpy scalars aren't json serializable
+        levels[col] = [getattr(value, 'item', lambda: value)()
+                       for value in col_levels]
+    return codes, levels
+
+
+def compile_bundle(trials, bundle_path, subj_info=None, stim_dir=STIM_DIR):
+    """ Write trials and the stimuli they reference to bundle_path. """
+    columns = list(trials.COLUMNS)
+    codes, levels = encode_trials(trials, columns)
+
+    payloads = []
+    for key, path in referenced_stimuli(trials, stim_dir):
+        data, meta = decode(path)
+        payloads.append((key, data, meta))
+
+    # Offsets are relative to the end of the header
+    offset = codes.nbytes
+    index = {}
+    for key, data, meta in payloads:
+        offset += -offset % ALIGN
+        meta.update(offset=offset, length=len(data))
+        index[key] = meta
+        offset += len(data)
+
+    header = json.dumps(dict(subj_info=subj_info or {}, columns=columns,
+                             levels=levels, num_trials=len(trials),
+                             stimuli=index))
+    with open(bundle_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        start = f.tell()
+        f.write(codes.tobytes())
+        for key, data, meta in payloads:
+            f.write('\0' * (start + meta['offset'] - f.tell()))
+            f.write(data)
+
+
+def stimulus_files(stim_dir=STIM_DIR):
+    """ (key, path) for every stimulus file in stim_dir. """
+    stimuli = []
+    for dirname, match in [('questions', '*.wav'), ('cues', '*.wav'),
+                           ('pics', '*.bmp'), ('dynamic_mask', '*.png'),
+                           ('feedback', '*.wav')]:
+        for path in Path(stim_dir, dirname).listdir(match):
+            stimuli.append((dirname + '/' + path.stem, path))
+    return stimuli
+
+
+def to_sound(pcm, channels, sample_rate):
+    """ int16 samples as floats in [-1, 1] at SAMPLE_RATE.
+
+    Mono sounds are a flat array of frames.
+    """
+    samples = resample(pcm.reshape(-1, channels), sample_rate, SAMPLE_RATE)
+    samples = samples / 32768.0
+    if channels == 1:
+        samples = samples.reshape(-1)
+    return samples, SAMPLE_RATE
+
+
+def _sound(data, meta):
+    return to_sound(np.frombuffer(data, dtype='<i2'), meta['channels'],
+                    meta['sample_rate'])
+
+
+def _pcm(data, meta):
+    return np.frombuffer(data, dtype='<i2'), meta
+
+
+def _image(data, meta):
+    return Image.frombuffer('RGB', tuple(meta['size']), data, 'raw', 'RGB',
+                            0, 1)
+
+
+class DecodedStimuli(object):
+    """ Stimuli decoded in memory, with the same interface as SessionBundle.
+
+    Decoding doesn't touch OpenGL or the audio server, so it can run on a
+    worker thread. Sounds and stims are then created on the main thread.
+    """
+    def __init__(self, stimuli):
+        self.stimuli = {}
+        for key, path in stimuli:
+            self.stimuli[key] = decode(path)
+
+    def keys(self, kind):
+        prefix = kind + '/'
+        return [key[len(prefix):] for key in self.stimuli
+                if key.startswith(prefix)]
+
+    def sound(self, key):
+        return _sound(*self.stimuli[key])
+
+    def pcm(self, key):
+        return _pcm(*self.stimuli[key])
+
+    def image(self, key):
+        return _image(*self.stimuli[key])
+
+
+class SessionBundle(object):
+    """ Read-only, memory-mapped view of a compiled bundle.
+
+    >>> bundle = SessionBundle('bundles/MDT146.bundle')
+    >>> trials = bundle.trials()
+    >>> samples, sample_rate = bundle.sound('questions/is-it-long')
+    >>> image = bundle.image('pics/apple')  # PIL.Image
+    """
+    def __init__(self, bundle_path):
+        self._file = open(bundle_path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a session bundle' % bundle_path)
+        pos = len(MAGIC)
+        header_len, = struct.unpack('<I', self._mmap[pos:pos+4])
+        pos += 4
+        self.header = json.loads(self._mmap[pos:pos+header_len])
+        self._start = pos + header_len
+        self.subj_info = self.header['subj_info']
+        self.stimuli = self.header['stimuli']
+
+    def _buffer(self, meta):
+        start = self._start + meta['offset']
+        return buffer(self._mmap, start, meta['length'])
+
+    def trials(self):
+        columns = self.header['columns']
+        num_trials = self.header['num_trials']
+        codes = np.frombuffer(self._mmap, dtype='<i2',
+                              count=num_trials * len(columns),
+                              offset=self._start)
+        codes = codes.reshape(num_trials, len(columns))
+        return Trials.from_codes(columns, codes, self.header['levels'])
+
+    def keys(self, kind):
+        """ Names of stimuli in a directory, e.g., 'questions'. """
+        prefix = kind + '/'
+        return [key[len(prefix):] for key in self.stimuli
+                if key.startswith(prefix)]
+
+    def sound(self, key):
+        """ Floats in [-1, 1] at SAMPLE_RATE, shaped (frames, channels).
+
+        Mono sounds are returned as a flat array of frames.
+        """
+        meta = self.stimuli[key]
+        return _sound(self._buffer(meta), meta)
+
+    def pcm(self, key):
+        """ Interleaved int16 samples and their metadata.
+
+        The samples are a view into the mapped file, not a copy.
+        """
+        meta = self.stimuli[key]
+        return _pcm(self._buffer(meta), meta)
+
+    def image(self, key):
+        meta = self.stimuli[key]
+        return _image(self._buffer(meta), meta)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+""" Check trial lists against the design constraints of Trials.make.
+
+    $ python check_trials.py --seeds 101:10101 --jobs 8
+    $ python check_trials.py data/*.csv
+
+All trial lists are checked at once in a single DataFrame, so checking many
+seeds is limited by how fast they can be made, not by the checks. Exits with
+a non-zero status if any trial list fails, so it can be run as a gate before
+a cohort starts.
+"""
+import argparse
+import sys
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from unipath import Path
+
+from trials import Trials
+
+# Columns that name a file in a stimuli directory
+STIMULUS_COLUMNS = [('question_slug', 'questions', '*.wav'),
+                    ('cue', 'cues', '*.wav'),
+                    ('pic', 'pics', '*.bmp')]
+
+
+def stack_trials(tables, keys=None):
+    """ One DataFrame of all trial lists, with a 'table' column.
+
+    tables are all Trials or all DataFrames.
+    """
+    tables = list(tables)
+    if keys is None:
+        keys = range(len(tables))
+    lengths = [len(table) for table in tables]
+    if all(isinstance(table, pd.DataFrame) for table in tables):
+        stacked = pd.concat(tables, ignore_index=True)
+    else:
+        # Much faster than making a DataFrame per trial list
+        stacked = Trials.concat(tables).to_frame(categorical=False)
+    stacked['table'] = np.repeat(keys, lengths)
+    return stacked
+
+
+def stimulus_names(stim_dir=Trials.STIM_DIR):
+    """ Names of the files available for each stimulus column. """
+    return {col: [path.stem for path in Path(stim_dir, dirname).listdir(match)]
+            for col, dirname, match in STIMULUS_COLUMNS}
+
+
+def check_trials(trials, block_size=None, tolerance=0.05,
+                 stim_dir=Trials.STIM_DIR, **kwargs):
+    """ Count violations of each design constraint per trial list.
+
+    trials is a DataFrame from stack_trials. Settings default to
+    Trials.DEFAULTS. Returns a DataFrame indexed by table with a column
+    per check and a 'passed' column. practice_repeats is reported but only
+    fails a list if practice_replace is False.
+    """
+    settings = dict(Trials.DEFAULTS)
+    settings.update(kwargs)
+    block_size = block_size or settings['block_size']
+
+    table = trials['table']
+    checks = pd.DataFrame(index=pd.Index(table.unique(), name='table'))
+
+    is_test = trials['block_type'] == 'test'
+
+    # Same cue on back to back trials in the same test block. Practice
+    # trials aren't shuffled by smart_shuffle.
+    same_block = ((table == table.shift()) &
+                  (trials['block'] == trials['block'].shift()))
+    cue_repeat = (is_test & same_block &
+                  (trials['cue'] == trials['cue'].shift()))
+    checks['cue_repeats'] = cue_repeat.groupby(table).sum()
+
+    # Propositions shown more than once to the same participant. Practice
+    # trials are taken out of the test trials, so they can only repeat
+    # among themselves, which the original draw (practice_replace) allows.
+    repeats = trials.duplicated(['table', 'proposition_id'])
+    checks['proposition_repeats'] = (repeats & is_test).groupby(table).sum()
+    checks['practice_repeats'] = (repeats & ~is_test).groupby(table).sum()
+
+    # Ratios set in Trials.make
+    for col, value, setting in [
+            ('correct_response', 'yes', 'ratio_yes_correct_responses'),
+            ('response_type', 'prompt', 'ratio_prompt_response_type')]:
+        ratio = (trials[col] == value).groupby(table).mean()
+        off = (ratio - settings[setting]).abs() > tolerance
+        checks['%s_ratio' % value] = off.astype(int)
+
+    # Test blocks: one per block_size trials. Block sizes can differ by
+    # more than 1, but add_block deals each cue's trials to the blocks
+    # round-robin, shuffling the order each round, so a cue's counts in
+    # any two blocks differ by at most 2.
+    test = trials[trials['block_type'] == 'test']
+    num_blocks = test.groupby('table')['block'].nunique()
+    expected = test.groupby('table').size() // block_size
+    per_cue = (test.groupby(['table', 'cue', 'block']).size()
+                   .unstack('block', fill_value=0))
+    spread = per_cue.max(axis=1) - per_cue.min(axis=1)
+    uneven = (spread > 2).groupby(level='table').sum()
+    bad_blocks = (num_blocks != expected) | (uneven > 0)
+    checks['block_sizes'] = bad_blocks.astype(int)
+
+    # Stimuli that don't exist
+    available = stimulus_names(stim_dir)
+    missing = pd.Series(False, index=trials.index)
+    for col, names in available.items():
+        values = trials[col].fillna('')
+        missing |= (values != '') & ~values.isin(names)
+    checks['missing_stimuli'] = missing.groupby(table).sum()
+
+    checks = checks.fillna(0).astype(int)
+    gates = list(checks.columns)
+    if settings['practice_replace']:
+        gates.remove('practice_repeats')
+    checks['passed'] = (checks[gates] == 0).all(axis=1)
+    return checks
+
+
+def _make(seed, settings):
+    return Trials.make(seed=seed, **settings)
+
+
+def make_seeds(seeds, jobs=1, **settings):
+    """ Make a trial list for each seed, in parallel if jobs > 1. """
+    make = partial(_make, settings=settings)
+    if jobs > 1:
+        from multiprocessing import Pool
+        pool = Pool(jobs)
+        try:
+            return pool.map(make, seeds, chunksize=16)
+        finally:
+            pool.close()
+    return map(make, seeds)
+
+
+def _seed_range(arg):
+    start, stop = arg.split(':')
+    return range(int(start), int(stop))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trials_csvs', nargs='*',
+                        help='Trial lists or data files to check')
+    parser.add_argument('--seeds', type=_seed_range, metavar='START:STOP',
+                        help='Check Trials.make for each seed in the range')
+    parser.add_argument('--jobs', '-j', type=int, default=1)
+    parser.add_argument('--block-size', type=int)
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help='Allowed difference from the design ratios')
+    parser.add_argument('--output', '-o',
+                        help='Write the checks for every trial list to csv')
+
+    args = parser.parse_args()
+
+    if args.seeds:
+        keys = args.seeds
+        trials = stack_trials(make_seeds(args.seeds, args.jobs), keys)
+    else:
+        keys = args.trials_csvs
+        trials = stack_trials([pd.read_csv(trials_csv)
+                               for trials_csv in args.trials_csvs], keys)
+
+    checks = check_trials(trials, block_size=args.block_size,
+                          tolerance=args.tolerance)
+    if args.output:
+        checks.to_csv(args.output)
+
+    failed = checks[~checks.passed]
+    print 'Checked %d trial lists: %d failed' % (len(checks), len(failed))
+    if len(failed):
+        print (failed.drop('passed', axis=1) > 0).sum().to_string()
+        print failed.head(20).to_string()
+        sys.exit(1)
@@ -0,0 +1,11 @@
+import os
+
+import pytest
+
+EXPERIMENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(autouse=True)
+def experiment_dir(monkeypatch):
+    """ Run tests from experiment/, where stimuli/ and data/ are. """
+    monkeypatch.chdir(EXPERIMENT_DIR)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+""" Compile a yaml design spec into settings for Trials.make.
+
+    $ python design.py design.yaml
+    $ python design.py variant.yaml --seeds 101:1101 --jobs 8
+
+The spec sets the within subject factors, the ratios of "yes" and "prompt"
+trials, reps, practice trials and block size (see design.yaml). Before any
+trials are sampled, the design is checked against propositions.csv, e.g.,
+that there are enough propositions in each cell for no proposition to
+repeat within a participant.
+"""
+import argparse
+from collections import OrderedDict
+
+import yaml
+
+from trials import Trials
+
+# Spec ratio -> Trials.make setting
+RATIO_SETTINGS = {
+    'correct_response': 'ratio_yes_correct_responses',
+    'response_type': 'ratio_prompt_response_type',
+}
+
+SPEC_SETTINGS = {
+    'reps': 'reps',
+    'practice_trials': 'num_practice',
+    'practice_replace': 'practice_replace',
+    'block_size': 'block_size',
+}
+
+# Columns of propositions.csv that propositions are selected on
+PROPOSITION_CELL = ['feat_type', 'correct_response']
+
+
+def load_design(design_yaml):
+    with open(design_yaml, 'r') as f:
+        return yaml.load(f)
+
+
+def compile_design(spec):
+    """ Trials.make settings for a design spec. """
+    settings = {}
+    for key, value in spec.items():
+        if key == 'factors':
+            settings['factors'] = compile_factors(value)
+        elif key == 'ratios':
+            for col, ratio in value.items():
+                if col not in RATIO_SETTINGS:
+                    raise ValueError('no ratio can be set for %s' % col)
+                settings[RATIO_SETTINGS[col]] = ratio
+        elif key in SPEC_SETTINGS:
+            settings[SPEC_SETTINGS[key]] = value
+        else:
+            raise ValueError('unknown design setting %s' % key)
+    return settings
+
+
+def compile_factors(factors):
+    """ Factors in the order they are listed in the spec.
+
+    A yaml mapping doesn't keep its order, so factors are a list of
+    one-item mappings, e.g., [{mask_type: [mask, nomask]}, ...].
+    """
+    if not isinstance(factors, list):
+        raise ValueError('factors must be a list of {factor: levels}, '
+                         'since their order changes the trials')
+    compiled = OrderedDict()
+    for factor in factors:
+        if not isinstance(factor, dict) or len(factor) != 1:
+            raise ValueError('each factor must be one {factor: levels}')
+        (name, levels), = factor.items()
+        compiled[name] = levels
+    return compiled
+
+
+def check_design(settings, propositions=None, tolerance=0.05):
+    """ Reasons Trials.make would fail or not produce the design.
+
+    Returns an empty list if the design is feasible.
+    """
+    settings = dict(Trials.DEFAULTS, **settings)
+    if propositions is None:
+        propositions = Trials.propositions()
+
+    problems = []
+    for factor in settings['factors']:
+        if factor not in Trials.COLUMNS:
+            problems.append('factor %s is not a trial column' % factor)
+    if 'feat_type' not in settings['factors']:
+        problems.append('feat_type must be a factor')
+    else:
+        missing = (set(settings['factors']['feat_type']) -
+                   set(propositions.feat_type))
+        if missing:
+            problems.append('no propositions with feat_type %s' %
+                            ', '.join(sorted(missing)))
+    for setting in RATIO_SETTINGS.values():
+        # expand copies the valid trials a whole number of times
+        if not 0.5 <= settings[setting] < 1:
+            problems.append('%s must be in [0.5, 1)' % setting)
+    if problems:
+        return problems
+
+    skeleton = Trials.make_skeleton(settings)
+    for col, setting in RATIO_SETTINGS.items():
+        value = 'yes' if col == 'correct_response' else 'prompt'
+        ratio = (skeleton[col] == value).mean()
+        if abs(ratio - settings[setting]) > tolerance:
+            problems.append('%s=%s gives a ratio of %.2f' %
+                            (setting, settings[setting], ratio))
+
+    needed = skeleton.groupby(PROPOSITION_CELL).size()
+    available = (propositions.groupby(PROPOSITION_CELL).size()
+                             .reindex(needed.index).fillna(0))
+    for cell in needed[needed > available].index:
+        problems.append('%s: needs %d propositions, only %d exist' % (
+            ' '.join('%s=%s' % pair for pair in zip(PROPOSITION_CELL, cell)),
+            needed[cell], available[cell]))
+
+    num_test = len(skeleton) - settings['num_practice']
+    if settings['num_practice'] < 0 or num_test < settings['block_size']:
+        problems.append('%d trials leaves %d test trials for blocks of %d' %
+                        (len(skeleton), num_test, settings['block_size']))
+    return problems
+
+
+def describe(settings):
+    """ The stages Trials.make will run for these settings. """
+    settings = dict(Trials.DEFAULTS, **settings)
+    skeleton = Trials.make_skeleton(settings)
+    num_test = len(skeleton) - settings['num_practice']
+    factors = ' x '.join('%s (%s)' % (factor, ', '.join(levels))
+                         for factor, levels in settings['factors'].items())
+    return '\n'.join([
+        'counterbalance: %s' % factors,
+        'expand: correct_response %.0f%% yes, response_type %.0f%% prompt' %
+        (100 * settings['ratio_yes_correct_responses'],
+         100 * settings['ratio_prompt_response_type']),
+        'extend: %d reps, %d trials' % (settings['reps'], len(skeleton)),
+        'assign_propositions: cue, proposition and pic per trial, '
+        '%d practice trials' % settings['num_practice'],
+        'add_block: %d blocks of ~%d test trials' % (
+            num_test // settings['block_size'],
+            num_test / (num_test // settings['block_size'] or 1)),
+        'smart_shuffle: no back to back cues within blocks',
+    ])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('design_yaml', nargs='?', default='design.yaml')
+    parser.add_argument('--seeds', metavar='START:STOP',
+                        help='Make and check trials for each seed')
+    parser.add_argument('--jobs', '-j', type=int, default=1)
+
+    args = parser.parse_args()
+
+    settings = compile_design(load_design(args.design_yaml))
+    problems = check_design(settings)
+    if problems:
+        raise SystemExit('Infeasible design:\n' + '\n'.join(problems))
+    print describe(settings)
+
+    if args.seeds:
+        from check_trials import make_seeds, stack_trials, check_trials
+        start, stop = map(int, args.seeds.split(':'))
+        seeds = range(start, stop)
+        trials = stack_trials(make_seeds(seeds, args.jobs, **settings), seeds)
+        checks = check_trials(trials, **settings)
+        print 'Checked %d trial lists: %d failed' % (len(checks),
+                                                    (~checks.passed).sum())
@@ -1,3 +1,8 @@
 #!/usr/bin/env python
-from psychopy_helper import *
+try:
+    from psychopy_helper import *
+except ImportError:
+    # psychopy isn't installed, e.g., on analysis machines. The design
+    # modules don't need it.
+    pass
 #from trials import *
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+labtools.background
+
+Run slow setup work on a worker thread while the main thread keeps the
+window responsive.
+
+    >>> trials = run_in_background(Trials.make, seed=101)
+    >>> experiment.show_instructions()
+    >>> trials = trials.result()  # waits only if it isn't done yet
+"""
+import sys
+import threading
+
+
+class Future(object):
+    """ The eventual result of a function running on a daemon thread. """
+    def __init__(self, func, *args, **kwargs):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run,
+                                        args=(func, args, kwargs))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, func, args, kwargs):
+        try:
+            self._result = func(*args, **kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """ Wait for the result. Exceptions are re-raised here. """
+        if not self._done.wait(timeout):
+            raise RuntimeError('timed out waiting for background work')
+        if self._exc_info is not None:
+            exc_type, exc_value, tb = self._exc_info
+            raise exc_type, exc_value, tb
+        return self._result
+
+
+def run_in_background(func, *args, **kwargs):
+    return Future(func, *args, **kwargs)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+"""
+labtools.coordinator
+
+Hand out unique subj_ids and seeds to lab stations and collect their trial
+rows in one place.
+
+    $ python -m labtools.coordinator --port 5005 --data-dir collected
+    $ python run.py --coordinator labserver:5005
+
+Messages are newline-delimited json over tcp, one reply per request:
+
+    {"op": "allocate", "prefix": "MDT", "computer": "LL-Kramer",
+     "next_free": "MDT146"}
+    -> {"subj_id": "MDT146", "seed": 146}
+    {"op": "trial", "subj_id": "MDT146", "columns": [...], "row": [...]}
+    -> {"ok": true}
+
+Stations never block on the coordinator. Rows are sent from a background
+thread, and rows that can't be delivered are appended to a local outbox
+that is replayed the next time the coordinator is reachable. Trials are
+deduplicated by (subj_id, trial), so replaying is safe.
+"""
+import json
+import os
+import socket
+import SocketServer
+import threading
+import time
+from Queue import Queue
+
+from session import SubjectRegistry
+
+
+class Collector(object):
+    """ Allocates subjects and writes rows into one data directory.
+
+    Used directly as the in-process stand-in for a coordinator server. If a
+    store (e.g., a trial_store.TrialStore) is given, rows are also written
+    to it.
+    """
+    DATA_DELIMITER = ','
+
+    def __init__(self, data_dir, store=None, seed_from=None):
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        self.data_dir = data_dir
+        self.registry = SubjectRegistry(data_dir)
+        if seed_from is not None:
+            # Data collected before the coordinator, e.g., a station's data
+            self.registry.scan(seed_from, '.csv')
+        self.lock = threading.Lock()
+        self.seen = {}   # subj_id -> set of trial numbers written
+        self.store = store
+        self._store_columns = None
+
+    def allocate(self, prefix, computer=None, next_free=None):
+        """ A subj_id after any the coordinator or the station has seen.
+
+        next_free is the station's own next free subj_id, so a coordinator
+        that hasn't collected anything yet doesn't hand out subj_ids that
+        the stations already have data for.
+        """
+        with self.lock:
+            numbers = [101]
+            for subj_id in [self.registry.next_subj_id(prefix), next_free]:
+                number = (subj_id or '')[len(prefix):]
+                if subj_id and subj_id.startswith(prefix) and number.isdigit():
+                    numbers.append(int(number))
+            n = max(numbers)
+            while self.registry.exists(dict(subj_id='%s%d' % (prefix, n))):
+                n += 1
+            subj_id = '%s%d' % (prefix, n)
+            self.registry.add(subj_id)
+            self.seen[subj_id] = set()
+        return dict(subj_id=subj_id, seed=int(subj_id[len(prefix):]))
+
+    def _seen_trials(self, subj_id, data_file):
+        """ Trial numbers already written, read from disk after a restart. """
+        if subj_id not in self.seen:
+            seen = set()
+            if os.path.exists(data_file):
+                with open(data_file, 'r') as f:
+                    header = f.readline().strip().split(self.DATA_DELIMITER)
+                    if 'trial' in header:
+                        col = header.index('trial')
+                        seen = set(line.strip().split(self.DATA_DELIMITER)[col]
+                                   for line in f)
+            self.seen[subj_id] = seen
+        return self.seen[subj_id]
+
+    def add_trial(self, subj_id, columns, row):
+        trial = unicode(dict(zip(columns, row)).get('trial'))
+        data_file = os.path.join(self.data_dir, '%s.csv' % subj_id)
+        with self.lock:
+            # Stations that were offline chose their own subj_ids
+            self.registry.add(subj_id)
+            seen = self._seen_trials(subj_id, data_file)
+            if trial in seen:
+                return
+            seen.add(trial)
+            new_file = not os.path.exists(data_file)
+            with open(data_file, 'a') as f:
+                if new_file:
+                    f.write(self.DATA_DELIMITER.join(columns) + '\n')
+                f.write(self.DATA_DELIMITER.join(map(unicode, row)) + '\n')
+            if self.store is not None:
+                if columns != self._store_columns:
+                    self.store.write_header(columns)
+                    self._store_columns = columns
+                self.store.write_trial(dict(zip(columns, row)))
+
+    def handle(self, message):
+        """ Reply to a single decoded message. """
+        op = message.get('op')
+        if op == 'allocate':
+            return self.allocate(message['prefix'], message.get('computer'),
+                                 message.get('next_free'))
+        elif op == 'trial':
+            self.add_trial(message['subj_id'], message['columns'],
+                           message['row'])
+            return dict(ok=True)
+        return dict(error='unknown op %r' % op)
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            try:
+                reply = self.server.collector.handle(json.loads(line))
+            except (ValueError, KeyError) as err:
+                reply = dict(error=str(err))
+            self.wfile.write(json.dumps(reply) + '\n')
+            self.wfile.flush()
+
+
+class CoordinatorServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, collector):
+        SocketServer.TCPServer.__init__(self, address, _Handler)
+        self.collector = collector
+
+
+class CoordinatorClient(object):
+    """ Station side of the coordinator.
+
+    >>> client = CoordinatorClient('labserver:5005')
+    >>> client.allocate('MDT')
+    {'subj_id': 'MDT146', 'seed': 146}
+    >>> client.send_trial('MDT146', columns, row)  # returns immediately
+    >>> client.close()  # wait for queued rows to be sent or buffered
+
+    Pass a Collector as address to skip the network entirely.
+    """
+    OUTBOX = 'coordinator_outbox.jsonl'
+    TIMEOUT = 2.0
+    RETRY_WAIT = 5.0
+
+    def __init__(self, address, outbox=None):
+        if isinstance(address, Collector):
+            self.collector, self.address = address, None
+        else:
+            self.collector = None
+            host, port = address.rsplit(':', 1)
+            self.address = (host, int(port))
+        self.outbox = outbox or self.OUTBOX
+        self._conn = None
+        self._lock = threading.Lock()
+        self._last_failure = None
+        self._queue = Queue()
+        self._sender = threading.Thread(target=self._send_loop)
+        self._sender.daemon = True
+        self._sender.start()
+
+    def _request(self, message):
+        if self.collector is not None:
+            return self.collector.handle(message)
+        with self._lock:
+            return self._send(message)
+
+    def _send(self, message):
+        if self._conn is None:
+            sock = socket.create_connection(self.address, self.TIMEOUT)
+            self._conn = (sock, sock.makefile('r'))
+        sock, reader = self._conn
+        try:
+            sock.sendall(json.dumps(message) + '\n')
+            reply = reader.readline()
+            if not reply:
+                raise socket.error('coordinator closed the connection')
+        except socket.error:
+            self._disconnect()
+            raise
+        return json.loads(reply)
+
+    def _disconnect(self):
+        if self._conn is not None:
+            self._conn[0].close()
+            self._conn = None
+
+    def allocate(self, prefix, computer=None, next_free=None):
+        """ Get a unique subj_id and seed, or None if unreachable.
+
+        next_free is the station's next free subj_id, which the
+        coordinator won't allocate below.
+        """
+        try:
+            return self._request(dict(op='allocate', prefix=prefix,
+                                      computer=computer,
+                                      next_free=next_free))
+        except (socket.error, ValueError):
+            return None
+
+    def send_trial(self, subj_id, columns, row):
+        self._queue.put(dict(op='trial', subj_id=subj_id,
+                             columns=list(columns), row=list(row)))
+
+    def close(self):
+        self._queue.put(None)
+        self._sender.join()
+        self._disconnect()
+
+    def _send_loop(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                break
+            if not self._deliver(message):
+                self._buffer(message)
+
+    def _deliver(self, message):
+        """ Send a message, replaying the outbox first. """
+        recently_failed = (self._last_failure is not None and
+                           time.time() - self._last_failure < self.RETRY_WAIT)
+        if recently_failed:
+            return False
+        try:
+            self.replay()
+            self._request(message)
+        except (socket.error, ValueError):
+            self._last_failure = time.time()
+            return False
+        self._last_failure = None
+        return True
+
+    def _buffer(self, message):
+        with open(self.outbox, 'a') as f:
+            f.write(json.dumps(message) + '\n')
+
+    def replay(self):
+        """ Send buffered messages. Raises socket.error if unreachable. """
+        if not os.path.exists(self.outbox):
+            return
+        with open(self.outbox, 'r') as f:
+            messages = [json.loads(line) for line in f if line.strip()]
+        for i, message in enumerate(messages):
+            try:
+                self._request(message)
+            except socket.error:
+                with open(self.outbox, 'w') as f:
+                    for unsent in messages[i:]:
+                        f.write(json.dumps(unsent) + '\n')
+                raise
+        os.remove(self.outbox)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--data-dir', default='collected')
+    parser.add_argument('--db', help='Also write trials to this sqlite file')
+    parser.add_argument('--seed-from', metavar='DATA_DIR',
+                        help='Never allocate subj_ids that have data here')
+
+    args = parser.parse_args()
+
+    store = None
+    if args.db:
+        from trial_store import TrialStore
+        store = TrialStore(args.db)
+
+    server = CoordinatorServer((args.host, args.port),
+                               Collector(args.data_dir, store,
+                                         args.seed_from))
+    print 'Collecting into %s on %s:%d' % (args.data_dir, args.host,
+                                           args.port)
+    server.serve_forever()
@@ -3,14 +3,17 @@ import unipath
 from psychopy.visual import ImageStim
 
 class DynamicMask(object):
-    def __init__(self, frames_dir, key='colored', **kwargs):
+    def __init__(self, frames_dir=None, key='colored', frames=None, **kwargs):
         """
         :param frames_dir: path to mask files
         :param key: str key to identify the correct set of masks
+        :param frames: list of images, optional. Used instead of frames_dir.
         :param **kwargs: args to pass to visual.ImageStim
         """
-        mask_files = unipath.Path(frames_dir).listdir('*.png')
-        self.masks = [ImageStim(image = str(pth), **kwargs) for pth in mask_files]
+        if frames is None:
+            mask_files = unipath.Path(frames_dir).listdir('*.png')
+            frames = [str(pth) for pth in mask_files]
+        self.masks = [ImageStim(image = frame, **kwargs) for frame in frames]
         self.cur_ix = 0
 
     def draw(self):
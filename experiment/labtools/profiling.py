@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+labtools.profiling
+
+Opt-in stage timers. Profiling is off unless the DUALVERIFICATION_PROFILE
+environment variable is set or profiler.enable() is called, in which case
+timing a stage costs two clock reads.
+
+    >>> from labtools.profiling import profiler
+    >>> with profiler.stage('make_trials'):
+    ...     trials = Trials.make(seed=1)
+    >>> profiler.summary()
+"""
+import cProfile
+import os
+import threading
+from collections import OrderedDict
+from timeit import default_timer
+
+
+class _NoStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_no_stage = _NoStage()
+
+
+class _Stage(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        stack = self.profiler._stack
+        stack.append(self.name)
+        # Register on entry so parents are listed before their children.
+        # Stages also run on background threads, so stats are locked.
+        with self.profiler.lock:
+            self.stat = self.profiler.stats.setdefault(';'.join(stack),
+                                                       [0, 0.0, 0.0])
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = default_timer() - self.start
+        self.profiler._stack.pop()
+        stat = self.stat
+        with self.profiler.lock:
+            stat[0] += 1
+            stat[1] += elapsed
+            stat[2] = max(stat[2], elapsed)
+        return False
+
+
+class Profiler(object):
+    """ Accumulate wall times for named, possibly nested, stages. """
+    ENV_VAR = 'DUALVERIFICATION_PROFILE'
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = bool(os.environ.get(self.ENV_VAR))
+        self.enabled = enabled
+        self._cprofile = None
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._local = threading.local()
+        self.stats = OrderedDict()   # stack path -> [count, total, max]
+
+    @property
+    def _stack(self):
+        # Each thread nests its own stages, e.g., trials made in the
+        # background while the main thread loads the window.
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def enable(self, cprofile=False):
+        """ Start timing stages, and optionally collect a cProfile. """
+        self.enabled = True
+        if cprofile and self._cprofile is None:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def _stats(self):
+        """ A copy of stats that other threads can't change. """
+        with self.lock:
+            return [(path, list(stat)) for path, stat in self.stats.items()]
+
+    def stage(self, name):
+        """ Context manager timing the enclosed block as stage name. """
+        if not self.enabled:
+            return _no_stage
+        return _Stage(self, name)
+
+    def summary(self):
+        """ Return a table of stage timings in milliseconds. """
+        rows = ['{:<50} {:>7} {:>10} {:>10} {:>10}'.format(
+            'stage', 'count', 'total', 'mean', 'max')]
+        for path, (count, total, max_) in self._stats():
+            depth = path.count(';')
+            name = '  ' * depth + path.split(';')[-1]
+            rows.append('{:<50} {:>7} {:>10.1f} {:>10.2f} {:>10.2f}'.format(
+                name, count, total*1000, total*1000/count, max_*1000))
+        return '\n'.join(rows)
+
+    def dump(self, path):
+        """ Write stage timings as folded stacks for flamegraph.pl.
+
+        Each line is "outer;inner microseconds". If a cProfile was
+        collected, it is also written to path + '.prof' for pstats,
+        snakeviz or gprof2dot.
+        """
+        stats = self._stats()
+        with open(path, 'w') as f:
+            for stack, (_, total, _) in stats:
+                # flamegraph expects self time, so subtract the children
+                children = sum(stat[1] for child, stat in stats
+                               if child.startswith(stack + ';') and
+                               child.count(';') == stack.count(';') + 1)
+                self_us = int(max(total - children, 0) * 1e6)
+                f.write('{} {}\n'.format(stack, self_us))
+
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(path + '.prof')
+
+
+profiler = Profiler()
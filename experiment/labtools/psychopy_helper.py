@@ -1,19 +1,22 @@
 #! /usr/bin/env python
 import os
 import random
-import socket
 
 import unipath
-import yaml
 
-from psychopy import core, event, visual, data, gui, misc, sound
+from psychopy import core, event, visual, data, gui, sound
 
-def get_subj_info(gui_yaml, check_exists, save_order=True):
+from session import (load_gui_config, default_subj_info,
+                     save_last_subj_info)
+
+def get_subj_info(gui_yaml, check_exists, save_order=True, registry=None,
+                  suggested=None):
     """ Create a psychopy.gui from a yaml config file.
 
-    The first time the experiment is run, a pickle of that subject's settings
-    is saved. On subsequent runs, the experiment tries to prepopulate the
-    settings with those of the previous subject.
+    The first time the experiment is run, that subject's settings are saved
+    next to the config file. On subsequent runs, the experiment tries to
+    prepopulate the settings with those of the previous subject. If a
+    registry is provided, the next free subj_id and seed are suggested.
 
     Parameters
     ----------
@@ -22,34 +25,25 @@ def get_subj_info(gui_yaml, check_exists, save_order=True):
         checks for its existence. If the file exists, an error is displayed.
     save_order: bool, Should the key order be saved in "_order"? Defaults to
         True.
+    registry: labtools.session.SubjectRegistry, optional.
+    suggested: dict, optional. Values to prepopulate instead of the
+        defaults, e.g., a subj_id and seed from a coordinator.
 
     Returns
     -------
     dict, with key order saved in "_order", if specified.
     """
-    with open(gui_yaml, 'r') as f:
-        gui_info = yaml.load(f)
-
-    ordered_fields = [field for _, field in sorted(gui_info.items())]
+    ordered_fields = load_gui_config(gui_yaml)
 
     # Determine order and tips
     ordered_names = [field['name'] for field in ordered_fields]
     field_tips = {field['name']: field['prompt'] for field in ordered_fields}
 
     # Load the last participant's options or use the defaults
-    last_subj_info = gui_yaml + '.pickle'
-    try:
-        gui_data = misc.fromFile(last_subj_info)
-        for yaml_name in ordered_names:
-            if yaml_name not in gui_data:
-                # Invalid pickle
-                raise AssertionError
-    except IOError, AssertionError:
-        gui_data = {field['name']: field['default'] for field in ordered_fields}
+    gui_data = default_subj_info(gui_yaml, registry, suggested)
 
     # Set fixed fields
     gui_data['date'] = data.getDateStr()
-    gui_data['computer'] = socket.gethostname()
     fixed_fields = ['date', 'computer']
 
     while True:
@@ -65,7 +59,9 @@ def get_subj_info(gui_yaml, check_exists, save_order=True):
         if check_exists(subj_info):
             popup_error('That subj_id already exists.')
         else:
-            misc.toFile(last_subj_info, subj_info)
+            save_last_subj_info(gui_yaml, subj_info)
+            if registry is not None:
+                registry.add(subj_info['subj_id'])
             break
 
     if save_order:
@@ -91,6 +87,31 @@ def load_images(stim_dir, match='*.bmp', **kwargs):
     return images
 
 
+def load_bundle_sounds(bundle, kind):
+    """ Create sounds from a SessionBundle or DecodedStimuli. """
+    sounds = {}
+    for name in bundle.keys(kind):
+        samples, sample_rate = bundle.sound(kind + '/' + name)
+        sounds[name] = sound.Sound(value=samples, sampleRate=sample_rate)
+    return sounds
+
+
+def load_store_sounds(store, kind):
+    """ StoredSounds from an AudioStore, played as psychopy Sounds. """
+    store.make_sound = lambda samples, sample_rate: sound.Sound(
+        value=samples, sampleRate=sample_rate)
+    return store.sounds(kind)
+
+
+def load_bundle_images(bundle, kind, **kwargs):
+    """ Create ImageStims from a SessionBundle or DecodedStimuli. """
+    images = {}
+    for name in bundle.keys(kind):
+        images[name] = visual.ImageStim(image=bundle.image(kind + '/' + name),
+                                        **kwargs)
+    return images
+
+
 def import_trials(fileName, method="sequential", seed=random.randint(1,100)):
 	(stimList,fieldNames)=data.importConditions(fileName,returnFieldNames=True)
 	trials = data.TrialHandler(stimList,1,method=method,seed=seed)
@@ -99,7 +120,6 @@ def import_trials(fileName, method="sequential", seed=random.randint(1,100)):
 def show_text(win, textToShow, color=[-1,-1,-1], waitForKey=True,
               acceptOnly=0, inputDevice="keyboard", mouse=False, pos=[0,0],
               scale=1):
-	global event
 	event.clearEvents() #clear all events just in case
 	win.flip()
 	if win.units == "pix":
@@ -132,12 +152,12 @@ def show_text(win, textToShow, color=[-1,-1,-1], waitForKey=True,
 			return
 	elif inputDevice=="gamepad": #also uses mouse if mouse is not false
 		while True:
-			for event in pygame.event.get(): #check responses
+			for pg_event in pygame.event.get(): #check responses
 				if mouse:
-					if event.type==pygame.MOUSEBUTTONDOWN:
+					if pg_event.type==pygame.MOUSEBUTTONDOWN:
 						pygame.event.clear()
 						return
-				if event.type==pygame.KEYDOWN or event.type==pygame.JOYBUTTONDOWN:
+				if pg_event.type==pygame.KEYDOWN or pg_event.type==pygame.JOYBUTTONDOWN:
 					pygame.event.clear()
 					return
 
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+labtools.session
+
+Session setup that doesn't need psychopy: cached gui config, a registry of
+existing subjects built from a single scan of the data directory, and a
+non-gui path for scripted sessions.
+"""
+import json
+import os
+import re
+import socket
+import time
+
+import yaml
+
+_config_cache = {}
+
+
+def load_gui_config(gui_yaml):
+    """ Parse a gui yaml file, reusing the parsed config until it changes.
+
+    Returns
+    -------
+    list of field dicts, in the order they should appear in the dialog.
+    """
+    mtime = os.path.getmtime(gui_yaml)
+    cached = _config_cache.get(gui_yaml)
+    if cached is None or cached[0] != mtime:
+        with open(gui_yaml, 'r') as f:
+            gui_info = yaml.load(f)
+        fields = [field for _, field in sorted(gui_info.items())]
+        _config_cache[gui_yaml] = (mtime, fields)
+    return _config_cache[gui_yaml][1]
+
+
+def fixed_fields():
+    """ Values for fields that the experimenter can't edit. """
+    return dict(date=time.strftime('%Y_%b_%d_%H%M'),
+                computer=socket.gethostname())
+
+
+def subj_id_prefix(subj_id):
+    """ The non-numeric start of a subj_id, e.g., 'MDT' for 'MDT101'. """
+    match = re.match(r'^(\D*)\d*$', str(subj_id))
+    return match.group(1) if match else ''
+
+
+class SubjectRegistry(object):
+    """ In-memory set of subj_ids that already have data files.
+
+    >>> registry = SubjectRegistry('data', bundle_dir='bundles')
+    >>> registry.exists({'subj_id': 'MDT101'})
+    True
+    >>> registry.next_subj_id('MDT')
+    'MDT146'
+
+    If bundle_dir is given, the subj_ids of compiled session bundles are
+    taken too, so they aren't given out again before the bundle is run.
+    """
+    def __init__(self, data_dir, ext='.csv', bundle_dir=None):
+        self.data_dir = data_dir
+        self.ext = ext
+        self.subj_ids = set()
+        self.scan(data_dir, ext)
+        if bundle_dir is not None:
+            self.scan(bundle_dir, '.bundle')
+
+    def scan(self, directory, ext):
+        """ Add the subj_ids named by the files in directory. """
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            stem, file_ext = os.path.splitext(name)
+            if file_ext == ext:
+                self.subj_ids.add(stem)
+
+    def exists(self, subj_info):
+        """ Drop-in replacement for get_subj_info's check_exists. """
+        return str(subj_info['subj_id']) in self.subj_ids
+
+    def add(self, subj_id):
+        self.subj_ids.add(str(subj_id))
+
+    def next_subj_id(self, prefix):
+        """ The first unused subj_id after the highest one with prefix. """
+        pattern = re.compile(r'^%s(\d+)$' % re.escape(prefix))
+        numbers = [int(match.group(1)) for match in
+                   map(pattern.match, self.subj_ids) if match]
+        if not numbers:
+            return None
+        n = max(numbers) + 1
+        while '%s%d' % (prefix, n) in self.subj_ids:
+            n += 1
+        return '%s%d' % (prefix, n)
+
+    def suggest(self, defaults):
+        """ Fill in the next free subj_id and a matching seed.
+
+        Seeds have been the numeric part of the subj_id, so the suggested
+        seed follows the suggested subj_id.
+        """
+        suggested = dict(defaults)
+        prefix = subj_id_prefix(defaults.get('subj_id', ''))
+        subj_id = self.next_subj_id(prefix)
+        if subj_id is not None:
+            suggested['subj_id'] = subj_id
+            if 'seed' in suggested:
+                suggested['seed'] = int(subj_id[len(prefix):])
+        return suggested
+
+
+def load_last_subj_info(gui_yaml, field_names):
+    """ Load the previous subject's options, if they are still valid. """
+    try:
+        with open(gui_yaml + '.json', 'r') as f:
+            last = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not all(name in last for name in field_names):
+        return None
+    return last
+
+
+def save_last_subj_info(gui_yaml, subj_info):
+    with open(gui_yaml + '.json', 'w') as f:
+        json.dump(subj_info, f)
+
+
+def default_subj_info(gui_yaml, registry=None, suggested=None):
+    """ Dialog values for the next session, without opening a dialog.
+
+    suggested values, e.g., from a coordinator, take precedence over the
+    registry's suggestions.
+    """
+    fields = load_gui_config(gui_yaml)
+    names = [field['name'] for field in fields]
+    subj_info = load_last_subj_info(gui_yaml, names)
+    if subj_info is None:
+        subj_info = {field['name']: field['default'] for field in fields}
+    if registry is not None:
+        subj_info = registry.suggest(subj_info)
+    subj_info.update(suggested or {})
+    subj_info.update(fixed_fields())
+    return subj_info
+
+
+def subj_info_from_json(json_arg, gui_yaml, registry, save_order=True,
+                        suggested=None):
+    """ Get subject info for a scripted session.
+
+    Parameters
+    ----------
+    json_arg: str, Path to a json file or a json object literal. Missing
+        fields are filled in from the gui defaults and registry suggestions.
+    gui_yaml: str, Path to the gui config file.
+    registry: SubjectRegistry, Used to reject subj_ids that already exist.
+    save_order: bool, Should the key order be saved in "_order"?
+    suggested: dict, optional. Values to use before the gui defaults.
+
+    Returns
+    -------
+    dict, same as get_subj_info.
+    """
+    if os.path.exists(json_arg):
+        with open(json_arg, 'r') as f:
+            given = json.load(f)
+    else:
+        given = json.loads(json_arg)
+
+    subj_info = default_subj_info(gui_yaml, registry, suggested)
+    subj_info.update(given)
+
+    if registry.exists(subj_info):
+        raise ValueError('subj_id %s already exists' % subj_info['subj_id'])
+    registry.add(subj_info['subj_id'])
+
+    if save_order:
+        names = [field['name'] for field in load_gui_config(gui_yaml)]
+        subj_info['_order'] = names + ['date', 'computer']
+    return subj_info
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+labtools.stage_cache
+
+Content-addressed cache for the stages of a slow computation. Each stage is
+keyed by its name and the json of everything it depends on, usually
+including the key of the stage before it, so changing a late stage reuses
+everything upstream.
+
+    >>> cache = StageCache(cache_dir='.stage_cache')
+    >>> key = cache.key('skeleton', ratio=0.75, reps=4)
+    >>> trials = cache.get(key, make_skeleton, 0.75, 4)
+
+Results are kept in memory, least recently used first out, and pickled to
+cache_dir if one is given. Results are copied on the way out, so callers
+are free to modify them.
+"""
+import copy
+import cPickle as pickle
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+
+def file_digest(path):
+    """ sha1 of a file's contents. """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class StageCache(object):
+    def __init__(self, maxsize=256, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def key(self, stage, **depends_on):
+        """ A key for stage from json serializable values. """
+        blob = json.dumps(depends_on, sort_keys=True, default=str)
+        return '%s-%s' % (stage, hashlib.sha1(blob).hexdigest())
+
+    def get(self, key, func, *args, **kwargs):
+        """ The cached result for key, calling func to make it if needed. """
+        if key in self._results:
+            result = self._results.pop(key)
+            self.hits += 1
+        else:
+            result = self._load(key)
+            if result is None:
+                self.misses += 1
+                result = func(*args, **kwargs)
+                self._save(key, result)
+            else:
+                self.hits += 1
+        self._results[key] = result
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+        return copy.deepcopy(result)
+
+    def clear(self):
+        self._results.clear()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def _load(self, key):
+        if self.cache_dir is None or not os.path.exists(self._path(key)):
+            return None
+        with open(self._path(key), 'rb') as f:
+            return pickle.load(f)
+
+    def _save(self, key, result):
+        if self.cache_dir is None:
+            return
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Write then rename so parallel makers never read a partial file
+        tmp = '%s.%d.tmp' % (self._path(key), os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self._path(key))
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+labtools.telemetry
+
+Send a small json event per trial to an aggregator so running sessions can
+be watched from another computer.
+
+    $ python -m labtools.telemetry --listen 0.0.0.0:5006
+    $ python run.py --telemetry labserver:5006
+
+Events are udp datagrams (or unix datagrams if the address is a path).
+Emitting never blocks: events go into a bounded queue that a background
+thread sends from, and events are dropped if the queue is full.
+"""
+import json
+import socket
+import threading
+import time
+from collections import deque, OrderedDict
+from Queue import Queue, Full
+
+
+def _address(address):
+    """ Socket family and address for 'host:port' or a unix socket path. """
+    if address.startswith('/'):
+        return socket.AF_UNIX, address
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+
+class TelemetryEmitter(object):
+    """ Non-blocking sender of per-trial events.
+
+    >>> telemetry = TelemetryEmitter('labserver:5006')
+    >>> telemetry.emit('trial', subj_id='MDT146', rt=512.3, is_correct=1)
+    """
+    def __init__(self, address, station=None, maxsize=256):
+        self.family, self.address = _address(address)
+        self.station = station or socket.gethostname()
+        self.dropped = 0
+        self._queue = Queue(maxsize=maxsize)
+        self._sender = threading.Thread(target=self._send_loop)
+        self._sender.daemon = True
+        self._sender.start()
+
+    def emit(self, kind, **fields):
+        fields.update(kind=kind, station=self.station, time=time.time())
+        try:
+            self._queue.put_nowait(fields)
+        except Full:
+            self.dropped += 1
+
+    def _send_loop(self):
+        sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        while True:
+            event = self._queue.get()
+            try:
+                sock.sendto(json.dumps(event, default=str), self.address)
+            except socket.error:
+                # Nobody is listening. Telemetry is best effort.
+                pass
+
+
+class StationStats(object):
+    """ Rolling stats over the last `window` trials from one station. """
+    # Seconds the question phase can run over its wav before TIMING
+    TIMING_TOLERANCE = 0.1
+
+    def __init__(self, window=50):
+        self.trials = deque(maxlen=window)
+        self.first_rts = []
+        self.subj_id = None
+        self.num_trials = 0
+        self.last_seen = None
+        self.last_kind = None
+
+    def add(self, event):
+        self.last_seen = event['time']
+        self.last_kind = event['kind']
+        if event.get('subj_id') != self.subj_id:
+            self.subj_id = event.get('subj_id')
+            self.trials.clear()
+            self.first_rts = []
+            self.num_trials = 0
+        if event['kind'] != 'trial':
+            return
+        self.num_trials += 1
+        self.trials.append(event)
+        # Baseline for rt drift: the first window of answered trials
+        answered = event.get('response') != 'timeout'
+        if answered and len(self.first_rts) < self.trials.maxlen:
+            self.first_rts.append(event['rt'])
+
+    def summary(self, now=None):
+        now = now or time.time()
+        trials = list(self.trials)
+        answered = [t for t in trials if t.get('response') != 'timeout']
+        rts = [t['rt'] for t in answered]
+        mean_rt = sum(rts) / len(rts) if rts else None
+        first_rt = (sum(self.first_rts) / len(self.first_rts)
+                    if self.first_rts else None)
+        summary = OrderedDict([
+            ('subj_id', self.subj_id),
+            ('trials', self.num_trials),
+            ('timeouts', (len(trials) - len(answered)) / float(len(trials))
+                         if trials else None),
+            ('accuracy', sum(t['is_correct'] for t in answered) /
+                         float(len(answered)) if answered else None),
+            ('mean_rt', mean_rt),
+            ('rt_drift', mean_rt - first_rt if rts and first_rt else None),
+            ('trial_dur', sum(t.get('trial_dur', 0) for t in trials) /
+                          len(trials) if trials else None),
+            ('idle', now - self.last_seen if self.last_seen else None),
+        ])
+        summary['flags'] = ' '.join(self.flags(summary, trials))
+        return summary
+
+    def flags(self, summary, trials):
+        """ Warnings about a station worth walking over to check. """
+        flags = []
+        if summary['timeouts'] is not None and summary['timeouts'] > 0.3:
+            flags.append('TIMEOUTS')
+        if any(self.audio_problem(t) for t in trials):
+            flags.append('AUDIO')
+        if any(self.timing_problem(t) for t in trials):
+            flags.append('TIMING')
+        if summary['idle'] is not None and summary['idle'] > 60 and \
+                self.last_kind != 'end':
+            flags.append('IDLE')
+        return flags
+
+    def audio_problem(self, trial):
+        """ The question didn't start playing, or its wav was empty.
+
+        question_played is the Sound's status right after play(), which is
+        false if the audio server isn't running.
+        """
+        if trial.get('question_played') is False:
+            return True
+        return trial.get('expected_question_dur', 1) <= 0
+
+    def timing_problem(self, trial):
+        """ The question phase ran over the length of the wav.
+
+        The phase waits for the length of the wav, so it can only run
+        over, when drawing the mask or flipping the window is slow.
+        """
+        if 'expected_question_dur' not in trial:
+            return False
+        return (trial['question_dur'] - trial['expected_question_dur'] >
+                self.TIMING_TOLERANCE)
+
+
+class Aggregator(object):
+    """ Collect events from all stations and keep rolling stats. """
+    def __init__(self, window=50):
+        self.window = window
+        self.stations = OrderedDict()
+
+    def add(self, event):
+        station = event.get('station', 'unknown')
+        if station not in self.stations:
+            self.stations[station] = StationStats(self.window)
+        self.stations[station].add(event)
+
+    def table(self):
+        rows = ['{:<16} {:<10} {:>6} {:>8} {:>8} {:>8} {:>8} {:>9} {:>6}  {}'
+                .format('station', 'subj_id', 'trials', 'timeout', 'acc',
+                        'rt', 'rt_drift', 'trial_dur', 'idle', 'flags')]
+        for station, stats in self.stations.items():
+            s = stats.summary()
+            fmt = lambda value, spec: ('-' if value is None else
+                                       format(value, spec))
+            rows.append('{:<16} {:<10} {:>6} {:>8} {:>8} {:>8} {:>8} {:>9} '
+                        '{:>6}  {}'.format(
+                            station[:16], s['subj_id'], s['trials'],
+                            fmt(s['timeouts'], '.0%'),
+                            fmt(s['accuracy'], '.0%'),
+                            fmt(s['mean_rt'], '.0f'),
+                            fmt(s['rt_drift'], '+.0f'),
+                            fmt(s['trial_dur'], '.2f'),
+                            fmt(s['idle'], '.0f'), s['flags']))
+        return '\n'.join(rows)
+
+    def listen(self, address, interval=5.0):
+        """ Receive events forever, printing the table every interval. """
+        family, address = _address(address)
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.bind(address)
+        sock.settimeout(interval)
+        last_print = 0
+        while True:
+            try:
+                data, _ = sock.recvfrom(65536)
+                self.add(json.loads(data))
+            except socket.timeout:
+                pass
+            except ValueError:
+                continue
+            if time.time() - last_print > interval:
+                print '\n' + self.table()
+                last_print = time.time()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listen', default='0.0.0.0:5006',
+                        help='host:port or a unix socket path')
+    parser.add_argument('--window', type=int, default=50,
+                        help='Number of recent trials per station')
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help='Seconds between printed summaries')
+
+    args = parser.parse_args()
+
+    Aggregator(args.window).listen(args.listen, args.interval)
@@ -0,0 +1,22 @@
+from labtools.coordinator import Collector
+
+
+def test_allocates_past_the_stations_next_free(tmpdir):
+    collector = Collector(str(tmpdir.join('collected')))
+    assert collector.allocate('MDT')['subj_id'] == 'MDT101'
+    allocated = collector.allocate('MDT', next_free='MDT146')
+    assert allocated == dict(subj_id='MDT146', seed=146)
+    assert collector.allocate('MDT', next_free='MDT120')['subj_id'] == 'MDT147'
+
+
+def test_received_trials_are_never_allocated(tmpdir):
+    collector = Collector(str(tmpdir.join('collected')))
+    collector.add_trial('MDT101', ['subj_id', 'trial'], ['MDT101', 1])
+    assert collector.allocate('MDT')['subj_id'] == 'MDT102'
+
+
+def test_seeded_from_existing_data(tmpdir):
+    tmpdir.join('data', 'MDT130.csv').write('subj_id,trial\n', ensure=True)
+    collector = Collector(str(tmpdir.join('collected')),
+                          seed_from=str(tmpdir.join('data')))
+    assert collector.allocate('MDT')['subj_id'] == 'MDT131'
@@ -0,0 +1,47 @@
+from labtools.stage_cache import StageCache
+
+
+def counter():
+    calls = []
+
+    def make(value):
+        calls.append(value)
+        return dict(value=value)
+    return make, calls
+
+
+def test_results_are_reused_and_copied():
+    cache = StageCache()
+    make, calls = counter()
+    key = cache.key('stage', a=1)
+    first = cache.get(key, make, 1)
+    first['value'] = 'changed'
+    assert cache.get(key, make, 1) == dict(value=1)
+    assert calls == [1]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_keys_depend_on_values_and_list_order():
+    cache = StageCache()
+    assert cache.key('stage', a=1, b=2) == cache.key('stage', b=2, a=1)
+    assert cache.key('stage', a=1) != cache.key('stage', a=2)
+    assert cache.key('other', a=1) != cache.key('stage', a=1)
+    assert (cache.key('stage', factors=[('x', [1]), ('y', [2])]) !=
+            cache.key('stage', factors=[('y', [2]), ('x', [1])]))
+
+
+def test_least_recently_used_is_evicted():
+    cache = StageCache(maxsize=2)
+    make, calls = counter()
+    for value in [1, 2, 1, 3, 1, 2]:
+        cache.get(cache.key('stage', value=value), make, value)
+    assert calls == [1, 2, 3, 2]
+
+
+def test_results_persist_in_cache_dir(tmpdir):
+    make, calls = counter()
+    key = StageCache().key('stage', a=1)
+    StageCache(cache_dir=str(tmpdir)).get(key, make, 1)
+    assert StageCache(cache_dir=str(tmpdir)).get(key, make, 1) == dict(value=1)
+    assert calls == [1]
+    assert not tmpdir.listdir('*.tmp')
@@ -0,0 +1,39 @@
+from labtools.telemetry import StationStats
+
+
+def trial_event(**fields):
+    event = dict(kind='trial', subj_id='MDT900', time=0.0, response='yes',
+                 rt=500.0, is_correct=1, trial_dur=4.0)
+    event.update(fields)
+    return event
+
+
+def flags(*events):
+    stats = StationStats()
+    for event in events:
+        stats.add(event)
+    return stats.summary(now=0.0)['flags'].split()
+
+
+def test_no_flags_when_question_plays_on_time():
+    assert flags(trial_event(question_played=True, question_dur=1.02,
+                             expected_question_dur=1.0)) == []
+
+
+def test_audio_flag_when_question_did_not_play():
+    assert 'AUDIO' in flags(trial_event(question_played=False,
+                                        question_dur=1.0,
+                                        expected_question_dur=1.0))
+
+
+def test_audio_flag_when_wav_is_empty():
+    assert 'AUDIO' in flags(trial_event(question_played=True,
+                                        question_dur=0.01,
+                                        expected_question_dur=0.0))
+
+
+def test_timing_flag_when_question_phase_overruns():
+    flagged = flags(trial_event(question_played=True, question_dur=1.6,
+                                expected_question_dur=1.0))
+    assert 'TIMING' in flagged
+    assert 'AUDIO' not in flagged
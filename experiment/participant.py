@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+from UserDict import UserDict
+
+from unipath import Path
+
+
+class Participant(UserDict):
+    """ Store participant data and provide helper functions.
+
+    >>> participant = Participant(subj_id=100, seed=539,
+                                  _order=['subj_id', 'seed'])
+    >>> participants.data_file
+    # data/100.csv
+    >>> participant.write_header(['trial', 'is_correct'])
+    # writes "subj_id,seed,trial,is_correct\n" to the data file
+    # and saves input as the order of columns in the output
+    >>> participant.write_trial({'trial': 1, 'is_correct': 1})
+    # writes "100,539,1,1\n" to the data file
+
+    Trials can also be written to a TrialStore so they can be read while
+    the session is running. The data file is still written trial by trial,
+    so a session that crashes leaves the trials it ran in the data file.
+    """
+    DATA_DIR = 'data'
+    DATA_DELIMITER = ','
+
+    def __init__(self, **kwargs):
+        """ Standard dict constructor.
+
+        Saves _order if provided. Raises an AssertionError if _order
+        isn't exhaustive of kwargs.
+        """
+        self._data_file = None
+        self.store = None
+        self._order = kwargs.pop('_order', kwargs.keys())
+
+        correct_len = len(self._order) == len(kwargs)
+        kwargs_in_order = all([kwg in self._order for kwg in kwargs])
+        assert correct_len & kwargs_in_order, "_order doesn't match kwargs"
+
+        self.data = dict(**kwargs)
+
+    def keys(self):
+        return self._order
+
+    @property
+    def data_file(self):
+        if not Path(self.DATA_DIR).exists():
+            Path(self.DATA_DIR).mkdir()
+
+        if not self._data_file:
+            data_file_name = '{subj_id}.csv'.format(**self)
+            self._data_file = Path(self.DATA_DIR, data_file_name)
+        return self._data_file
+
+    def use_store(self, store):
+        """ Write trials to a trial_store.TrialStore. """
+        self.store = store
+
+    def write_header(self, trial_col_names):
+        """ Writes the names of the columns and saves the order. """
+        self._col_names = self._order + trial_col_names
+        self._write_line(self.DATA_DELIMITER.join(self._col_names))
+        if self.store is not None:
+            self.store.write_header(self._col_names)
+
+    def trial_data(self, trial):
+        assert self._col_names, 'write header first to save column order'
+        trial_data = dict(self)
+        trial_data.update(trial)
+        return trial_data
+
+    def trial_row(self, trial):
+        """ Values for a trial in the order of the header. """
+        trial_data = self.trial_data(trial)
+        return [str(trial_data[key]) for key in self._col_names]
+
+    def write_trial(self, trial):
+        row_data = self.trial_row(trial)
+        self._write_line(self.DATA_DELIMITER.join(row_data))
+        if self.store is not None:
+            self.store.write_trial(self.trial_data(trial))
+
+    def close(self):
+        """ Finish writing trials queued for the store. """
+        if self.store is not None:
+            self.store.close()
+
+    def _write_line(self, row):
+        with open(self.data_file, 'a') as f:
+            f.write(row + '\n')
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+""" Track how often each proposition has been shown across participants.
+
+    $ python proposition_usage.py           # update and summarize the index
+
+The index is saved as json and updated incrementally: only data files that
+are new or have changed since the last update are read.
+"""
+import argparse
+import json
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from unipath import Path
+
+
+class PropositionUsage(object):
+    """ Counts of trials per proposition_id over existing data files.
+
+    >>> usage = PropositionUsage.load('proposition_usage.json')
+    >>> usage.update('data')
+    >>> usage.save()
+    >>> usage.weights(['pig:visual:no:4', 'pig:visual:no:5'])
+    # higher probability for whichever was used less
+    """
+    INDEX_JSON = 'proposition_usage.json'
+
+    def __init__(self, files=None, index_json=None):
+        # data file name -> dict(mtime=..., counts={proposition_id: n})
+        self.files = dict(files or {})
+        self.index_json = index_json or self.INDEX_JSON
+        self.counts = Counter()
+        for info in self.files.values():
+            self.counts.update(info['counts'])
+
+    @classmethod
+    def load(cls, index_json=None):
+        index_json = index_json or cls.INDEX_JSON
+        try:
+            with open(index_json, 'r') as f:
+                files = json.load(f)
+        except IOError:
+            files = None
+        return cls(files, index_json)
+
+    def save(self):
+        with open(self.index_json, 'w') as f:
+            json.dump(self.files, f, indent=2, sort_keys=True)
+
+    def update(self, data_dir):
+        """ Add counts from data files not yet in the index.
+
+        A file that changed since it was read is recounted. Returns the
+        names of the files that were read.
+        """
+        read = []
+        for data_file in Path(data_dir).listdir('*.csv'):
+            mtime = os.path.getmtime(data_file)
+            last = self.files.get(data_file.name)
+            if last is not None:
+                if last['mtime'] == mtime:
+                    continue
+                self.counts.subtract(last['counts'])
+            trials = pd.read_csv(data_file, usecols=['proposition_id'])
+            file_counts = Counter(trials.proposition_id.dropna())
+            self.counts.update(file_counts)
+            self.files[data_file.name] = dict(mtime=mtime,
+                                              counts=dict(file_counts))
+            read.append(data_file.name)
+        return read
+
+    def weights(self, proposition_ids, strength=1.0):
+        """ Sampling probabilities favoring the least used propositions.
+
+        Each proposition is weighted by 1/(1 + extra)**strength, where extra
+        is how many more times it has been used than the least used option.
+        strength=0 is uniform sampling.
+        """
+        counts = np.array([self.counts.get(p, 0) for p in proposition_ids],
+                          dtype=float)
+        extra = counts - counts.min()
+        weights = 1.0 / (1.0 + extra) ** strength
+        return weights / weights.sum()
+
+    def summary(self, propositions):
+        """ Usage counts for every proposition in the bank. """
+        usage = propositions[['proposition_id', 'cue', 'feat_type',
+                              'correct_response']].copy()
+        usage['count'] = [self.counts.get(p, 0)
+                          for p in usage.proposition_id]
+        return usage
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--index', default=PropositionUsage.INDEX_JSON)
+    parser.add_argument('--output', '-o',
+                        help='Write per-proposition counts to this csv')
+
+    args = parser.parse_args()
+
+    from trials import Trials
+
+    usage = PropositionUsage.load(args.index)
+    read = usage.update(args.data_dir)
+    usage.save()
+
+    summary = usage.summary(Trials.propositions())
+    print 'Read %d new data files' % len(read)
+    print summary['count'].describe()
+    print 'Never used: %d' % (summary['count'] == 0).sum()
+    if args.output:
+        summary.to_csv(args.output, index=False)
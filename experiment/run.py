@@ -1,11 +1,8 @@
 #!/usr/bin/env python
 import argparse
-import copy
 import yaml
-from UserDict import UserDict
-from UserList import UserList
+from timeit import default_timer
 
-import pandas as pd
 from unipath import Path
 
 from psychopy import prefs
@@ -17,229 +14,59 @@ except ImportError:
 
 prefs.general['audioLib'] = ['pyo']
 from psychopy import visual, core, event, sound
+from psychopy.constants import STARTED
 
 print 'initializing pyo to 48000'
 sound.init(48000, buffer=128)
 print 'Using %s(with %s) for sounds' % (sound.audioLib, sound.audioDriver)
 
-from labtools.psychopy_helper import get_subj_info, load_sounds, load_images
+from labtools.psychopy_helper import (get_subj_info, load_images,
+                                      load_bundle_sounds, load_bundle_images,
+                                      load_store_sounds)
+from labtools.session import (SubjectRegistry, subj_info_from_json,
+                              default_subj_info, subj_id_prefix,
+                              fixed_fields)
+from labtools.coordinator import CoordinatorClient
 from labtools.dynamic_mask import DynamicMask
-from labtools.trials_functions import (counterbalance, expand, extend,
-                                       add_block, smart_shuffle)
-
-
-class Participant(UserDict):
-    """ Store participant data and provide helper functions.
-
-    >>> participant = Participant(subj_id=100, seed=539,
-                                  _order=['subj_id', 'seed'])
-    >>> participants.data_file
-    # data/100.csv
-    >>> participant.write_header(['trial', 'is_correct'])
-    # writes "subj_id,seed,trial,is_correct\n" to the data file
-    # and saves input as the order of columns in the output
-    >>> participant.write_trial({'trial': 1, 'is_correct': 1})
-    # writes "100,539,1,1\n" to the data file
-    """
-    DATA_DIR = 'data'
-    DATA_DELIMITER = ','
-
-    def __init__(self, **kwargs):
-        """ Standard dict constructor.
-
-        Saves _order if provided. Raises an AssertionError if _order
-        isn't exhaustive of kwargs.
-        """
-        self._data_file = None
-        self._order = kwargs.pop('_order', kwargs.keys())
-
-        correct_len = len(self._order) == len(kwargs)
-        kwargs_in_order = all([kwg in self._order for kwg in kwargs])
-        assert correct_len & kwargs_in_order, "_order doesn't match kwargs"
-
-        self.data = dict(**kwargs)
-
-    def keys(self):
-        return self._order
-
-    @property
-    def data_file(self):
-        if not Path(self.DATA_DIR).exists():
-            Path(self.DATA_DIR).mkdir()
-
-        if not self._data_file:
-            data_file_name = '{subj_id}.csv'.format(**self)
-            self._data_file = Path(self.DATA_DIR, data_file_name)
-        return self._data_file
-
-    def write_header(self, trial_col_names):
-        """ Writes the names of the columns and saves the order. """
-        self._col_names = self._order + trial_col_names
-        self._write_line(self.DATA_DELIMITER.join(self._col_names))
-
-    def write_trial(self, trial):
-        assert self._col_names, 'write header first to save column order'
-        trial_data = dict(self)
-        trial_data.update(trial)
-        row_data = [str(trial_data[key]) for key in self._col_names]
-        self._write_line(self.DATA_DELIMITER.join(row_data))
-
-    def _write_line(self, row):
-        with open(self.data_file, 'a') as f:
-            f.write(row + '\n')
-
-
-class Trials(UserList):
-    STIM_DIR = Path('stimuli')
-    COLUMNS = [
-        # Trial columns
-        'block',
-        'block_type',
-        'trial',
-
-        # Stimuli columns
-        'proposition_id',
-        'feat_type',
-        'question_slug',
-        'cue',
-        'mask_type',
-        'response_type',
-        'pic',
-        'correct_response',
-
-        # Response columns
-        'response',
-        'rt',
-        'is_correct',
-    ]
-    DEFAULTS = dict(
-        ratio_yes_correct_responses=0.75,
-        ratio_prompt_response_type=0.75,
-    )
-
-    @classmethod
-    def make(cls, **kwargs):
-        """ Create a list of trials.
-
-        Each trial is a dict with values for all keys in self.COLUMNS.
-        """
-        settings = dict(cls.DEFAULTS)
-        settings.update(kwargs)
-
-        seed = settings.get('seed')
-        prng = pd.np.random.RandomState(seed)
-
-        # Balance within subject variables
-        trials = counterbalance({'feat_type': ['visual', 'nonvisual'],
-                                 'mask_type': ['mask', 'nomask']})
-        trials = expand(trials, name='correct_response', values=['yes', 'no'],
-                        ratio=settings['ratio_yes_correct_responses'],
-                        seed=seed)
-        trials = expand(trials, name='response_type', values=['prompt', 'pic'],
-                        ratio=settings['ratio_prompt_response_type'],
-                        seed=seed)
-
-        # Extend the trials to final length
-        trials = extend(trials, reps=4)
-
-        # Read proposition info
-        propositions_csv = Path(cls.STIM_DIR, 'propositions.csv')
-        propositions = pd.read_csv(propositions_csv)
-
-        # Add cue
-        categories = propositions.cue.unique()
-        trials['cue'] = prng.choice(categories, len(trials), replace=True)
+from labtools.profiling import profiler
+from labtools.background import Future, run_in_background
+from labtools.telemetry import TelemetryEmitter
 
-        _propositions = propositions.copy()
+from design import load_design, compile_design, check_design
+from audio_store import AudioStore
+from bundle import (BUNDLE_DIR, SessionBundle, DecodedStimuli,
+                    compile_bundle, stimulus_files)
+from participant import Participant
+from proposition_usage import PropositionUsage
+from trial_store import TrialStore
+from trials import Trials
 
-        def determine_question(row):
-            is_cue = (_propositions.cue == row['cue'])
-            is_feat_type = (_propositions.feat_type == row['feat_type'])
-            is_correct_response = (_propositions.correct_response ==
-                                   row['correct_response'])
 
-            valid_propositions = (is_cue & is_feat_type & is_correct_response)
+def is_playing(snd):
+    """ Whether snd started, and the audio server is running to play it. """
+    server = getattr(sound, 'pyoSndServer', None)
+    if server is not None and not server.getIsStarted():
+        return False
+    return snd.status == STARTED
 
-            if valid_propositions.sum() == 0:
-                trials.ix[row.name, 'cue'] = prng.choice(categories)
-                return determine_question(trials.ix[row.name, ])
 
-            options = _propositions.ix[valid_propositions, ]
-            selected_ix = prng.choice(options.index)
-            selected_proposition_id = options.ix[selected_ix, 'proposition_id']
-            _propositions.drop(selected_ix, inplace=True)
-
-            return selected_proposition_id
-
-        trials['proposition_id'] = trials.apply(determine_question, axis=1)
-
-        # Merge in question
-        trials = trials.merge(propositions)
-
-        # Add in picture
-        def determine_pic(row):
-            if row['response_type'] != 'pic':
-                return ''
-            elif row['correct_response'] == 'yes':
-                return row['cue']
-            else:
-                distractors = list(categories)
-                distractors.remove(row['cue'])
-                return prng.choice(distractors)
-
-        trials['pic'] = trials.apply(determine_pic, axis=1)
-
-        # Add columns for response variables
-        for col in ['response', 'rt', 'is_correct']:
-            trials[col] = ''
-
-        # Add practice trials
-        num_practice = 8
-        practice_ix = prng.choice(trials.index, num_practice)
-        practice_trials = trials.ix[practice_ix, ]
-        practice_trials['block'] = 0
-        practice_trials['block_type'] = 'practice'
-        trials.drop(practice_ix, inplace=True)
-
-        # Finishing touches
-        trials = add_block(trials, 50, name='block', start=1, groupby='cue',
-                           seed=seed)
-        trials = smart_shuffle(trials, col='cue', block='block', seed=seed)
-        trials['block_type'] = 'test'
-
-        # Merge practice trials
-        trials = pd.concat([practice_trials, trials])
-
-        # Label trial
-        trials['trial'] = range(len(trials))
-
-        # Reorcder columns
-        trials = trials[cls.COLUMNS]
-
-        return cls(trials.to_dict('record'))
-
-    def write_trials(self, trials_csv):
-        trials = pd.DataFrame.from_records(self)
-        trials = trials[self.COLUMNS]
-        trials.to_csv(trials_csv, index=False)
-
-    def iter_blocks(self, key='block'):
-        """ Yield blocks of trials. """
-        block = self[0][key]
-        trials_in_block = []
-        for trial in self:
-            if trial[key] == block:
-                trials_in_block.append(trial)
-            else:
-                yield trials_in_block
-                block = trial[key]
-                trials_in_block = []
+# Trial columns sent to the telemetry aggregator
+TELEMETRY_COLUMNS = ['block', 'trial', 'feat_type', 'mask_type',
+                     'response_type', 'response', 'rt', 'is_correct']
 
 
 class Experiment(object):
     STIM_DIR = Path('stimuli')
 
-    def __init__(self, settings_yaml, texts_yaml):
+    def __init__(self, settings_yaml, texts_yaml, stimuli=None):
+        """ Create the window and load all stimuli.
+
+        stimuli can be a SessionBundle or DecodedStimuli, in which case
+        stims are created from decoded data instead of reading STIM_DIR.
+        It can also be a Future of either. Then the window and instruction
+        screens are ready right away, and the trial stimuli are created
+        once wait_for_stimuli is called.
+        """
         with open(settings_yaml, 'r') as f:
             exp_info = yaml.load(f)
 
@@ -250,94 +77,218 @@ class Experiment(object):
         with open(texts_yaml, 'r') as f:
             self.texts = yaml.load(f)
 
-        self.win = visual.Window(fullscr=True, units='pix')
+        with profiler.stage('window'):
+            self.win = visual.Window(fullscr=True, units='pix')
 
         text_kwargs = dict(height=60, font='Consolas', color='black')
         self.fix = visual.TextStim(self.win, text='+', **text_kwargs)
         self.prompt = visual.TextStim(self.win, text='Yes or No?',
                                       **text_kwargs)
 
-        self.questions = load_sounds(Path(self.STIM_DIR, 'questions'))
-        self.cues = load_sounds(Path(self.STIM_DIR, 'cues'))
-
-        size = [400, 400]
-        image_kwargs = dict(win=self.win, size=size)
-        self.mask = DynamicMask(Path(self.STIM_DIR, 'dynamic_mask'),
-                                **image_kwargs)
-        self.pics = load_images(Path(self.STIM_DIR, 'pics'), **image_kwargs)
+        self.size = [400, 400]
         frame_buffer = 20
-        self.frame = visual.Rect(self.win, width=size[0]+20, height=size[1]+20,
+        self.frame = visual.Rect(self.win, width=self.size[0]+frame_buffer,
+                                 height=self.size[1]+frame_buffer,
                                  lineColor='black')
 
-        feedback_dir = Path(self.STIM_DIR, 'feedback')
+        self._pending = None
+        if isinstance(stimuli, Future):
+            self._pending, stimuli = stimuli, None
+        else:
+            self.load_stimuli(stimuli)
+
+        # Feedback is played during the instructions
+        if stimuli is None:
+            feedback_dir = Path(self.STIM_DIR, 'feedback')
+            feedback = {name: sound.Sound(Path(feedback_dir, name + '.wav'))
+                        for name in ['buzz', 'bleep']}
+        else:
+            feedback = load_bundle_sounds(stimuli, 'feedback')
         self.feedback = {}
-        self.feedback[0] = sound.Sound(Path(feedback_dir, 'buzz.wav'))
-        self.feedback[1] = sound.Sound(Path(feedback_dir, 'bleep.wav'))
+        self.feedback[0] = feedback['buzz']
+        self.feedback[1] = feedback['bleep']
+
+        with profiler.stage('make_screens'):
+            self.screens = self.make_screens(stimuli)
 
         self.timer = core.Clock()
+        self._prepared = None
+        # Measured durations of the last trial's phases, for telemetry
+        self.timing = {}
+
+    def load_stimuli(self, stimuli=None):
+        """ Create the sounds and images used in trials. """
+        with profiler.stage('load_sounds'):
+            # Sounds are only created for the clips about to be played
+            kinds = ['questions', 'cues']
+            if stimuli is None:
+                self.audio = AudioStore.from_files(self.STIM_DIR, kinds)
+            else:
+                self.audio = AudioStore.from_stimuli(stimuli, kinds)
+            self.questions = load_store_sounds(self.audio, 'questions')
+            self.cues = load_store_sounds(self.audio, 'cues')
+
+        image_kwargs = dict(win=self.win, size=self.size)
+        with profiler.stage('load_images'):
+            if stimuli is None:
+                self.mask = DynamicMask(Path(self.STIM_DIR, 'dynamic_mask'),
+                                        **image_kwargs)
+                self.pics = load_images(Path(self.STIM_DIR, 'pics'),
+                                        **image_kwargs)
+            else:
+                frames = [stimuli.image('dynamic_mask/' + name) for name in
+                          sorted(stimuli.keys('dynamic_mask'))]
+                self.mask = DynamicMask(frames=frames, **image_kwargs)
+                self.pics = load_bundle_images(stimuli, 'pics',
+                                               **image_kwargs)
+
+    def wait_for_stimuli(self):
+        """ Finish loading stimuli that were decoded in the background. """
+        if self._pending is not None:
+            with profiler.stage('wait_for_stimuli'):
+                self.load_stimuli(self._pending.result())
+            self._pending = None
+
+    def make_screens(self, stimuli=None):
+        """ Build all text screens and instruction images once.
+
+        Each stim is drawn to the back buffer and cleared, so text layout
+        and texture upload happen here instead of the first time a screen
+        is shown, e.g., a timeout screen in the middle of a block.
+        """
+        screen_kwargs = dict(height=30, wrapWidth=600, color='black',
+                             font='Consolas')
+        screens = {}
+        for name in ['end_of_practice', 'timeout', 'break_screen',
+                     'end_of_experiment']:
+            screens[name] = visual.TextStim(self.win, text=self.texts[name],
+                                            **screen_kwargs)
+
+        if stimuli is None:
+            apple = str(Path(self.STIM_DIR, 'pics', 'apple.bmp'))
+            mask = str(Path(self.STIM_DIR, 'dynamic_mask', 'colored_1.png'))
+        else:
+            apple = stimuli.image('pics/apple')
+            mask = stimuli.image('dynamic_mask/colored_1')
+
+        example_pos = [0, -100]
+        screens['pic_apple'] = visual.ImageStim(self.win, apple,
+                                                pos=example_pos)
+        screens['mask'] = visual.ImageStim(self.win, mask, pos=example_pos)
+
+        for stim in screens.values():
+            stim.draw()
+        self.win.clearBuffer()
+
+        return screens
+
+    def prepare_trial(self, trial):
+        """ Look up and warm up everything a trial presents.
 
-    def run_trial(self, trial):
-        """ Run a trial using a dict of settings. """
-        question = self.questions[trial['question_slug']]
-        cue = self.cues[trial['cue']]
+        Creates the question and cue Sounds from the audio store, resets
+        the mask and draws the response stim to the back buffer,
+        which is then cleared, so its texture is bound before the trial.
+        """
+        prepared = dict(
+            question=self.questions[trial['question_slug']],
+            cue=self.cues[trial['cue']],
+        )
 
-        question_dur = question.getDuration()
-        cue_dur = question.getDuration()
+        prepared['question'].load()
+        prepared['cue'].load()
+        prepared['question_dur'] = prepared['question'].getDuration()
+        prepared['cue_dur'] = prepared['question'].getDuration()
 
         stim_during_audio = [self.fix, ]
         if trial['mask_type'] == 'mask':
+            self.mask.reset()
             stim_during_audio.insert(0, self.mask)
+        prepared['stim_during_audio'] = stim_during_audio
 
         if trial['response_type'] == 'prompt':
             response_stim = self.prompt
         else:
             response_stim = self.pics[trial['pic']]
+        prepared['response_stim'] = response_stim
+
+        response_stim.draw()
+        self.win.clearBuffer()
+
+        return prepared
+
+    def run_trial(self, trial, next_trial=None):
+        """ Run a trial using a dict of settings.
+
+        If next_trial is given, it is prepared during the ITI.
+        """
+        if self._prepared is not None and self._prepared[0] is trial:
+            prepared = self._prepared[1]
+        else:
+            prepared = self.prepare_trial(trial)
+        self._prepared = None
+
+        question = prepared['question']
+        cue = prepared['cue']
+        question_dur = prepared['question_dur']
+        cue_dur = prepared['cue_dur']
+        stim_during_audio = prepared['stim_during_audio']
+        response_stim = prepared['response_stim']
 
         self.frame.autoDraw = True
 
         # Start trial presentation
         # ------------------------
-        self.timer.reset()
-        self.fix.draw()
-        self.win.flip()
-        core.wait(self.waits['fix_duration'])
+        with profiler.stage('fix'):
+            self.timer.reset()
+            self.fix.draw()
+            self.win.flip()
+            core.wait(self.waits['fix_duration'])
 
         # Play the question
-        self.timer.reset()
-        question.play()
-        while self.timer.getTime() < question_dur:
-            [stim.draw() for stim in stim_during_audio]
-            self.win.flip()
-            core.wait(self.waits['mask_refresh'])
+        with profiler.stage('question'):
+            self.timer.reset()
+            question_start = default_timer()
+            question.play()
+            self.timing['question_played'] = is_playing(question.load())
+            while self.timer.getTime() < question_dur:
+                [stim.draw() for stim in stim_during_audio]
+                self.win.flip()
+                core.wait(self.waits['mask_refresh'])
+            self.timing['question_dur'] = default_timer() - question_start
 
         # Delay between question offset and cue onset
-        self.timer.reset()
-        while self.timer.getTime() < self.waits['question_offset_to_cue_onset']:
-            [stim.draw() for stim in stim_during_audio]
-            self.win.flip()
-            core.wait(self.waits['mask_refresh'])
+        with profiler.stage('question_offset_to_cue_onset'):
+            self.timer.reset()
+            delay = self.waits['question_offset_to_cue_onset']
+            while self.timer.getTime() < delay:
+                [stim.draw() for stim in stim_during_audio]
+                self.win.flip()
+                core.wait(self.waits['mask_refresh'])
 
         # Play the cue
-        self.timer.reset()
-        cue.play()
-        while self.timer.getTime() < cue_dur:
-            [stim.draw() for stim in stim_during_audio]
-            self.win.flip()
-            core.wait(self.waits['mask_refresh'])
+        with profiler.stage('cue'):
+            self.timer.reset()
+            cue.play()
+            while self.timer.getTime() < cue_dur:
+                [stim.draw() for stim in stim_during_audio]
+                self.win.flip()
+                core.wait(self.waits['mask_refresh'])
 
         # Cue offset to response onset
-        self.win.flip()
-        core.wait(self.waits['cue_offset_to_response_onset'])
+        with profiler.stage('cue_offset_to_response_onset'):
+            self.win.flip()
+            core.wait(self.waits['cue_offset_to_response_onset'])
 
         # Show the response prompt
-        self.timer.reset()
-        response_stim.draw()
-        self.win.flip()
-        response = event.waitKeys(maxWait=self.waits['max_wait'],
-                                  keyList=self.response_keys.keys(),
-                                  timeStamped=self.timer)
-        self.frame.autoDraw = False
-        self.win.flip()
+        with profiler.stage('response'):
+            self.timer.reset()
+            response_stim.draw()
+            self.win.flip()
+            response = event.waitKeys(maxWait=self.waits['max_wait'],
+                                      keyList=self.response_keys.keys(),
+                                      timeStamped=self.timer)
+            self.frame.autoDraw = False
+            self.win.flip()
         # ----------------------
         # End trial presentation
 
@@ -361,7 +312,13 @@ class Experiment(object):
         if response == 'timeout':
             self.show_timeout_screen()
 
-        core.wait(self.waits['iti'])
+        with profiler.stage('iti'):
+            self.timer.reset()
+            if next_trial is not None:
+                with profiler.stage('prepare_trial'):
+                    self._prepared = (next_trial,
+                                      self.prepare_trial(next_trial))
+            core.wait(max(self.waits['iti'] - self.timer.getTime(), 0))
 
         return trial
 
@@ -392,14 +349,8 @@ class Experiment(object):
                 example.setText(example_txt)
                 example.draw()
 
-            if tag == 'pic_apple':
-                img_path = str(Path('stimuli', 'pics', 'apple.bmp'))
-                apple = visual.ImageStim(self.win, img_path, pos=[0, -100])
-                apple.draw()
-            elif tag == 'mask':
-                img_path = str(Path('stimuli', 'dynamic_mask', 'colored_1.png'))
-                mask = visual.ImageStim(self.win, img_path, pos=[0, -100])
-                mask.draw()
+            if tag in ['pic_apple', 'mask']:
+                self.screens[tag].draw()
 
             self.win.flip()
             key = event.waitKeys(keyList=advance_keys)[0]
@@ -410,60 +361,154 @@ class Experiment(object):
             if key in ['up', 'down']:
                 self.feedback[1].play()
 
-    def show_end_of_practice_screen(self):
-        visual.TextStim(self.win, text=self.texts['end_of_practice'],
-                        height=30, wrapWidth=600, color='black',
-                        font='Consolas').draw()
+    def show_screen(self, name):
+        self.screens[name].draw()
         self.win.flip()
         event.waitKeys(keyList=['space', ])
 
+    def show_end_of_practice_screen(self):
+        self.show_screen('end_of_practice')
+
     def show_timeout_screen(self):
-        visual.TextStim(self.win, text=self.texts['timeout'],
-                        height=30, wrapWidth=600, color='black',
-                        font='Consolas').draw()
-        self.win.flip()
-        event.waitKeys(keyList=['space', ])
+        self.show_screen('timeout')
 
     def show_break_screen(self):
-        visual.TextStim(self.win, text=self.texts['break_screen'],
-                        height=30, wrapWidth=600, color='black',
-                        font='Consolas').draw()
-        self.win.flip()
-        event.waitKeys(keyList=['space', ])
+        self.show_screen('break_screen')
 
     def show_end_of_experiment_screen(self):
-        visual.TextStim(self.win, text=self.texts['end_of_experiment'],
-                        height=30, wrapWidth=600, color='black',
-                        font='Consolas').draw()
-        self.win.flip()
-        event.waitKeys(keyList=['space', ])
+        self.show_screen('end_of_experiment')
+
+
+def get_participant(subj_info_json=None, registry=None, client=None):
+    """ Get subject info from the gui, or from json for scripted sessions. """
+    # One scan of the data directory for all subj_id uniqueness checks.
+    # Bundles that haven't been run yet have taken their subj_ids too.
+    registry = registry or SubjectRegistry(Participant.DATA_DIR,
+                                           bundle_dir=BUNDLE_DIR)
+
+    # Ask the coordinator for a subj_id and seed that no other station has
+    allocated = None
+    if client is not None:
+        defaults = default_subj_info('gui.yaml', registry)
+        prefix = subj_id_prefix(defaults['subj_id'])
+        allocated = client.allocate(prefix, defaults['computer'],
+                                    registry.next_subj_id(prefix))
+        if allocated is None:
+            print 'Coordinator unreachable. Trials will be sent later.'
+
+    if subj_info_json:
+        participant_data = subj_info_from_json(subj_info_json, 'gui.yaml',
+                                               registry, suggested=allocated)
+    else:
+        participant_data = get_subj_info(
+            'gui.yaml',
+            check_exists=registry.exists,
+            registry=registry,
+            suggested=allocated,
+        )
 
+    return Participant(**participant_data)
 
-def main():
-    participant_data = get_subj_info(
-        'gui.yaml',
-        # check_exists is a simple function to determine if the data file
-        # exists, provided subj_info data. Here it's used to check for
-        # uniqueness in subj_ids when getting info from gui.
-        check_exists=lambda subj_info:
-            Participant(**subj_info).data_file.exists()
-    )
 
-    participant = Participant(**participant_data)
-    trials = Trials.make(**participant)
+def make_trials(participant, balance_propositions=False, design=None):
+    """ Make trials for a participant.
+
+    design is the Trials.make settings from a design spec (see design.py).
+    """
+    settings = dict(participant, **(design or {}))
+    usage = None
+    if balance_propositions:
+        usage = PropositionUsage.load()
+        usage.update(Participant.DATA_DIR)
+        usage.save()
+
+    with profiler.stage('Trials.make'):
+        return Trials.make(proposition_usage=usage, **settings)
+
+
+def compile_session(subj_info_json=None, balance_propositions=False,
+                    output=None, design=None):
+    """ Make a participant's trials ahead of time and save a bundle. """
+    participant = get_participant(subj_info_json)
+    trials = make_trials(participant, balance_propositions, design)
+    subj_info = dict(participant, _order=participant.keys())
+
+    if output is None:
+        BUNDLE_DIR.mkdir()
+        output = Path(BUNDLE_DIR, '{subj_id}.bundle'.format(**participant))
+    compile_bundle(trials, output, subj_info)
+    print 'Wrote %s' % output
+
+
+def main(subj_info_json=None, balance_propositions=False, coordinator=None,
+         bundle_path=None, db_path=None, telemetry_address=None,
+         design=None):
+    client = None
+    if coordinator:
+        client = CoordinatorClient(coordinator)
+
+    telemetry = None
+    if telemetry_address:
+        telemetry = TelemetryEmitter(telemetry_address)
+
+    if bundle_path:
+        # Trials and stimuli were prepared by compile_session
+        stimuli = SessionBundle(bundle_path)
+        # date and computer are for the session, not the compile
+        participant = Participant(**dict(stimuli.subj_info,
+                                         **fixed_fields()))
+        if SubjectRegistry(Participant.DATA_DIR).exists(participant):
+            raise ValueError('subj_id %s already exists' %
+                             participant['subj_id'])
+        trials = stimuli.trials()
+    else:
+        participant = get_participant(subj_info_json, client=client)
+        # Make trials and decode stimuli while the instructions are shown
+        trials = run_in_background(make_trials, participant,
+                                   balance_propositions, design)
+        stimuli = run_in_background(DecodedStimuli,
+                                    stimulus_files(Experiment.STIM_DIR))
 
     # Start of experiment
-    experiment = Experiment('settings.yaml', 'texts.yaml')
+    with profiler.stage('Experiment.__init__'):
+        experiment = Experiment('settings.yaml', 'texts.yaml', stimuli)
     experiment.show_instructions()
 
+    if isinstance(trials, Future):
+        with profiler.stage('wait_for_trials'):
+            trials = trials.result()
+    experiment.wait_for_stimuli()
+
+    if db_path:
+        participant.use_store(TrialStore(db_path))
     participant.write_header(trials.COLUMNS)
 
+    if telemetry is not None:
+        telemetry.emit('start', subj_id=participant['subj_id'])
+
     for block in trials.iter_blocks():
         block_type = block[0]['block_type']
 
-        for trial in block:
-            trial_data = experiment.run_trial(trial)
-            participant.write_trial(trial_data)
+        for i, trial in enumerate(block):
+            next_trial = block[i+1] if i+1 < len(block) else None
+            trial_start = default_timer()
+            with profiler.stage('run_trial'):
+                trial_data = experiment.run_trial(trial, next_trial)
+            with profiler.stage('write_trial'):
+                participant.write_trial(trial_data)
+            if client is not None:
+                client.send_trial(participant['subj_id'],
+                                  participant._col_names,
+                                  participant.trial_row(trial_data))
+            if telemetry is not None:
+                question = experiment.questions[trial_data['question_slug']]
+                telemetry.emit(
+                    'trial', subj_id=participant['subj_id'],
+                    trial_dur=default_timer() - trial_start,
+                    question_played=experiment.timing['question_played'],
+                    question_dur=experiment.timing['question_dur'],
+                    expected_question_dur=question.getDuration(),
+                    **{col: trial_data[col] for col in TELEMETRY_COLUMNS})
 
         if block_type == 'practice':
             experiment.show_end_of_practice_screen()
@@ -472,20 +517,66 @@ def main():
 
     experiment.show_end_of_experiment_screen()
 
+    participant.close()
+    if telemetry is not None:
+        telemetry.emit('end', subj_id=participant['subj_id'])
+    if client is not None:
+        client.close()
+
     import webbrowser
     webbrowser.open(experiment.survey_url.format(**participant))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('command', choices=['run', 'trials', 'instructions', 'test', 'survey'],
+    parser.add_argument('command', choices=['run', 'trials', 'instructions', 'test', 'survey',
+                                            'compile'],
                         nargs='?', default='run')
     parser.add_argument('--output', '-o', help='Name of output file')
+    parser.add_argument('--subj-info',
+                        help='Skip the gui. Path to a json file or a json '
+                             'object with subject info, e.g. \'{"seed": 3}\'')
+    parser.add_argument('--bundle',
+                        help='Run a session prepared with the compile command')
+    parser.add_argument('--db', metavar='SQLITE_FILE',
+                        help='Write trials to a shared sqlite database, e.g., '
+                             'data/trials.sqlite, as well as the csv')
+    parser.add_argument('--telemetry', metavar='HOST:PORT',
+                        help='Send per-trial events to a telemetry '
+                             'aggregator (python -m labtools.telemetry)')
+    parser.add_argument('--design', metavar='DESIGN_YAML',
+                        help='Make trials from a design spec, e.g., '
+                             'design.yaml (see design.py)')
+    parser.add_argument('--balance-propositions', action='store_true',
+                        help='Favor propositions shown to the fewest '
+                             'participants in the data directory')
+    parser.add_argument('--coordinator', metavar='HOST:PORT',
+                        help='Get the subj_id and seed from a lab '
+                             'coordinator and send it each trial')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time startup and trial stages and print a '
+                             'summary at the end. Also enabled by the %s '
+                             'environment variable.' % profiler.ENV_VAR)
+    parser.add_argument('--profile-output',
+                        help='Write stage timings as folded stacks for '
+                             'flamegraph.pl, and a cProfile to '
+                             'PROFILE_OUTPUT.prof')
 
     args = parser.parse_args()
 
+    if args.profile or args.profile_output:
+        profiler.enable(cprofile=bool(args.profile_output))
+
+    design = None
+    if args.design:
+        design = compile_design(load_design(args.design))
+        problems = check_design(design)
+        if problems:
+            raise SystemExit('Infeasible design:\n' + '\n'.join(problems))
+
     if args.command == 'trials':
-        trials = Trials.make()
+        with profiler.stage('Trials.make'):
+            trials = Trials.make(**(design or {}))
         trials.write_trials(args.output or 'sample_trials.csv')
     elif args.command == 'instructions':
         experiment = Experiment('settings.yaml', 'texts.yaml')
@@ -505,9 +596,18 @@ if __name__ == '__main__':
         trial_data = experiment.run_trial(trial_settings)
         import pprint
         pprint.pprint(trial_data)
+    elif args.command == 'compile':
+        compile_session(args.subj_info, args.balance_propositions,
+                        args.output, design)
     elif args.command == 'survey':
         experiment = Experiment('settings.yaml', 'texts.yaml')
         import webbrowser
         webbrowser.open(experiment.survey_url.format(subj_id='TEST_SUBJ', computer='TEST_COMPUTER'))
     else:
-        main()
+        main(args.subj_info, args.balance_propositions, args.coordinator,
+             args.bundle, args.db, args.telemetry, design)
+
+    if profiler.enabled:
+        print profiler.summary()
+        if args.profile_output:
+            profiler.dump(args.profile_output)
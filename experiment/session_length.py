@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+""" Estimate how long a session will take.
+
+    $ python session_length.py --seed 146
+    $ python session_length.py sample_trials.csv --max-minutes 30
+
+Question and cue durations are read from the wav headers and cached in a
+json index by file mtime, so only new or changed files are opened. Trial
+times follow the waits in settings.yaml and the order of events in
+Experiment.run_trial.
+"""
+import argparse
+import json
+import os
+import wave
+
+import yaml
+from unipath import Path
+
+from trials import Trials
+
+
+class DurationIndex(object):
+    """ Durations of wav files, read from their headers.
+
+    >>> index = DurationIndex.load()
+    >>> index.update('stimuli', ['questions', 'cues'])
+    >>> index.save()
+    >>> index.durations('questions')['is-it-long']
+    1.07
+    """
+    INDEX_JSON = 'wav_durations.json'
+
+    def __init__(self, files=None, index_json=None):
+        # wav path -> dict(mtime=..., duration=...)
+        self.files = dict(files or {})
+        self.index_json = index_json or self.INDEX_JSON
+
+    @classmethod
+    def load(cls, index_json=None):
+        index_json = index_json or cls.INDEX_JSON
+        files = None
+        if os.path.exists(index_json):
+            with open(index_json, 'r') as f:
+                files = json.load(f)
+        return cls(files, index_json)
+
+    def save(self):
+        with open(self.index_json, 'w') as f:
+            json.dump(self.files, f, indent=2, sort_keys=True)
+
+    def update(self, stim_dir=Trials.STIM_DIR, kinds=('questions', 'cues')):
+        """ Read the headers of new or changed wavs. Returns their paths. """
+        read = []
+        current = set()
+        for kind in kinds:
+            for wav in Path(stim_dir, kind).listdir('*.wav'):
+                path = str(wav)
+                current.add(path)
+                mtime = os.path.getmtime(path)
+                info = self.files.get(path)
+                if info is not None and info['mtime'] == mtime:
+                    continue
+                f = wave.open(path, 'rb')
+                duration = f.getnframes() / float(f.getframerate())
+                f.close()
+                self.files[path] = dict(mtime=mtime, duration=duration)
+                read.append(path)
+        # Forget wavs that were removed
+        for path in set(self.files) - current:
+            if Path(path).parent.name in kinds:
+                del self.files[path]
+        return read
+
+    def durations(self, kind):
+        """ Duration in seconds by stimulus name, e.g., question_slug. """
+        return {Path(path).stem: info['duration']
+                for path, info in self.files.items()
+                if Path(path).parent.name == kind}
+
+
+def load_waits(settings_yaml='settings.yaml'):
+    with open(settings_yaml, 'r') as f:
+        return yaml.load(f)['waits']
+
+
+def estimate(trials, waits, index, rt=None, screens=0.0):
+    """ Seconds per block and in total for the trials that will be run.
+
+    rt is the expected response time in seconds; defaults to
+    waits['max_wait'], which gives an upper bound. screens is the time
+    allowed for each self-paced screen between blocks.
+
+    Returns a DataFrame with a row per block and a 'total' row.
+    """
+    frame = trials.to_frame(categorical=False)
+    # main only runs the trials that iter_blocks yields
+    run = [trial.index for block in trials.iter_blocks() for trial in block]
+    frame = frame.iloc[run]
+
+    for col, kind in [('question_slug', 'questions'), ('cue', 'cues')]:
+        missing = set(frame[col]) - set(index.durations(kind))
+        if missing:
+            raise ValueError('no wav in %s for %s' % (kind,
+                                                      ', '.join(missing)))
+    question_dur = frame.question_slug.map(index.durations('questions'))
+
+    if rt is None:
+        rt = waits['max_wait']
+    # run_trial plays the cue for the duration of the question
+    seconds = (waits['fix_duration'] + question_dur +
+               waits['question_offset_to_cue_onset'] + question_dur +
+               waits['cue_offset_to_response_onset'] + rt + waits['iti'])
+
+    blocks = seconds.groupby(frame.block.values).agg(['count', 'sum'])
+    blocks.columns = ['trials', 'seconds']
+    blocks['seconds'] += screens
+    blocks.loc['total'] = blocks.sum()
+    blocks['minutes'] = blocks.seconds / 60.0
+    return blocks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trials_csv', nargs='?',
+                        help='Trials to estimate. Defaults to Trials.make')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--settings', default='settings.yaml')
+    parser.add_argument('--rt', type=float,
+                        help='Expected response time in seconds. '
+                             'Defaults to the max_wait')
+    parser.add_argument('--screens', type=float, default=0.0,
+                        help='Seconds for the screen after each block')
+    parser.add_argument('--max-minutes', type=float,
+                        help='Exit with an error if the session is longer')
+
+    args = parser.parse_args()
+
+    index = DurationIndex.load()
+    index.update()
+    index.save()
+
+    if args.trials_csv:
+        trials = Trials.read_trials(args.trials_csv)
+    else:
+        trials = Trials.make(seed=args.seed)
+
+    blocks = estimate(trials, load_waits(args.settings), index, args.rt,
+                      args.screens)
+    print blocks.to_string(float_format=lambda x: '%.1f' % x)
+
+    if args.max_minutes and blocks.minutes['total'] > args.max_minutes:
+        raise SystemExit('Session is longer than %.1f minutes' %
+                         args.max_minutes)
@@ -0,0 +1,83 @@
+import wave
+
+import numpy as np
+from unipath import Path
+
+from audio_store import AudioStore
+from bundle import SAMPLE_RATE, DecodedStimuli, SessionBundle, compile_bundle
+from labtools.session import SubjectRegistry
+from trials import Trials
+
+
+def make_bundle(tmpdir, subj_id='MDT900'):
+    trials = Trials.make(seed=101, cache=None)
+    bundle_path = str(tmpdir.join(subj_id + '.bundle'))
+    compile_bundle(trials, bundle_path, dict(subj_id=subj_id, seed=101))
+    return trials, SessionBundle(bundle_path)
+
+
+def test_trials_round_trip(tmpdir):
+    trials, bundle = make_bundle(tmpdir)
+    try:
+        assert bundle.subj_info == dict(subj_id='MDT900', seed=101)
+        read = bundle.trials().to_frame(categorical=False)
+        assert read.equals(trials.to_frame(categorical=False))
+    finally:
+        bundle.close()
+
+
+def test_audio_is_stored_at_the_native_rate(tmpdir):
+    trials, bundle = make_bundle(tmpdir)
+    try:
+        slug = trials[0]['question_slug']
+        f = wave.open(str(Path('stimuli', 'questions', slug + '.wav')), 'rb')
+        frames = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+        rate = f.getframerate()
+        f.close()
+
+        pcm, meta = bundle.pcm('questions/' + slug)
+        assert meta['sample_rate'] == rate
+        assert np.array_equal(pcm, frames)
+
+        samples, sample_rate = bundle.sound('questions/' + slug)
+        assert sample_rate == SAMPLE_RATE
+        assert abs(len(samples) / float(SAMPLE_RATE) -
+                   len(frames) / float(meta['channels'] * rate)) < 0.001
+    finally:
+        bundle.close()
+
+
+def test_images(tmpdir):
+    _, bundle = make_bundle(tmpdir)
+    try:
+        assert bundle.image('pics/apple').size == tuple(
+            bundle.stimuli['pics/apple']['size'])
+    finally:
+        bundle.close()
+
+
+def test_compiled_bundles_reserve_subj_ids(tmpdir):
+    make_bundle(tmpdir, 'MDT900')[1].close()
+    registry = SubjectRegistry('data', bundle_dir=str(tmpdir))
+    assert registry.exists(dict(subj_id='MDT900'))
+    assert registry.next_subj_id('MDT') == 'MDT901'
+
+
+def test_decoded_clips_are_packed_into_one_buffer():
+    files = [(kind + '/' + path.stem, path) for kind in ['questions', 'cues']
+             for path in Path('stimuli', kind).listdir('*.wav')]
+    store = AudioStore.from_stimuli(DecodedStimuli(files),
+                                    ['questions', 'cues'])
+    buffers = set(id(clip.pcm.base) for clip in store.clips.values())
+    assert len(buffers) == 1
+    assert store.clips.values()[0].pcm.base.nbytes == store.nbytes
+
+
+def test_bundle_clips_are_views(tmpdir):
+    _, bundle = make_bundle(tmpdir)
+    try:
+        store = AudioStore.from_stimuli(bundle, ['questions'])
+        for key, clip in store.clips.items():
+            assert np.may_share_memory(clip.pcm, bundle.pcm(key)[0])
+    finally:
+        bundle.close()
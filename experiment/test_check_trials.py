@@ -0,0 +1,25 @@
+from check_trials import check_trials, make_seeds, stack_trials
+
+SEEDS = range(1, 41)
+
+
+def test_made_trials_pass():
+    trials = stack_trials(make_seeds(SEEDS, cache=None), SEEDS)
+    checks = check_trials(trials)
+    assert checks.passed.all(), checks[~checks.passed]
+
+
+def test_practice_repeats_fail_without_replacement():
+    trials = stack_trials(make_seeds(SEEDS, cache=None), SEEDS)
+    checks = check_trials(trials, practice_replace=False)
+    # The original draw repeats a practice trial for some seeds
+    assert (checks.practice_repeats > 0).any()
+    assert (checks.passed == (checks.practice_repeats == 0)).all()
+
+
+def test_unique_practice_trials_pass():
+    trials = stack_trials(make_seeds(SEEDS, cache=None,
+                                     practice_replace=False), SEEDS)
+    checks = check_trials(trials, practice_replace=False)
+    assert checks.passed.all(), checks[~checks.passed]
+    assert (checks.practice_repeats == 0).all()
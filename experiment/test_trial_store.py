@@ -0,0 +1,78 @@
+import time
+
+import pandas as pd
+
+from participant import Participant
+from trial_store import TrialStore
+
+COLUMNS = ['subj_id', 'trial', 'rt']
+
+
+def test_writer_thread_writes_every_trial(tmpdir):
+    store = TrialStore(str(tmpdir.join('trials.sqlite')), batch_size=7)
+    store.write_header(COLUMNS)
+    for trial in range(50):
+        store.write_trial(dict(subj_id='MDT900', trial=trial, rt=trial * 2.0))
+    store.close()
+    trials = store.read()
+    assert trials.trial.tolist() == range(50)
+    assert trials.rt.tolist() == [trial * 2.0 for trial in range(50)]
+
+
+def test_trials_are_readable_before_close(tmpdir):
+    store = TrialStore(str(tmpdir.join('trials.sqlite')), flush_interval=0.01)
+    store.write_header(COLUMNS)
+    store.write_trial(dict(subj_id='MDT900', trial=0, rt=500.0))
+    for _ in range(100):
+        if len(store.read()):
+            break
+        time.sleep(0.01)
+    assert len(store.read()) == 1
+    store.close()
+
+
+def test_rewriting_a_trial_replaces_it(tmpdir):
+    store = TrialStore(str(tmpdir.join('trials.sqlite')))
+    store.write_header(COLUMNS)
+    store.write_trial(dict(subj_id='MDT900', trial=0, rt=500.0))
+    store.write_trial(dict(subj_id='MDT900', trial=0, rt=600.0))
+    store.close()
+    assert store.read().rt.tolist() == [600.0]
+
+
+def test_new_header_adds_columns(tmpdir):
+    store = TrialStore(str(tmpdir.join('trials.sqlite')))
+    store.write_header(COLUMNS)
+    store.write_trial(dict(subj_id='MDT900', trial=0, rt=500.0))
+    store.write_header(COLUMNS + ['response'])
+    store.write_trial(dict(subj_id='MDT901', trial=0, rt=400.0,
+                           response='yes'))
+    store.close()
+    assert store.subjects() == ['MDT900', 'MDT901']
+    assert 'response' in store.read().columns
+
+
+def test_export_csv(tmpdir):
+    store = TrialStore(str(tmpdir.join('trials.sqlite')))
+    store.write_header(COLUMNS)
+    for trial in [1, 0]:
+        store.write_trial(dict(subj_id='MDT900', trial=trial, rt=500.0))
+    store.close()
+    csv_path = str(tmpdir.join('MDT900.csv'))
+    store.export_csv('MDT900', csv_path)
+    exported = pd.read_csv(csv_path)
+    assert exported.columns.tolist() == COLUMNS
+    assert exported.trial.tolist() == [0, 1]
+
+
+def test_participant_writes_csv_with_a_store(tmpdir, monkeypatch):
+    monkeypatch.setattr(Participant, 'DATA_DIR', str(tmpdir))
+    participant = Participant(subj_id='MDT900', _order=['subj_id'])
+    participant.use_store(TrialStore(str(tmpdir.join('trials.sqlite'))))
+    participant.write_header(['trial', 'rt'])
+    participant.write_trial(dict(trial=0, rt=500.0))
+    # Written before close, so a crash doesn't lose it
+    written = pd.read_csv(str(participant.data_file))
+    assert written.trial.tolist() == [0]
+    participant.close()
+    assert participant.store.read().trial.tolist() == [0]
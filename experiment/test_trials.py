@@ -0,0 +1,113 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from labtools.stage_cache import StageCache
+from trials import Trials
+
+# Columns that Trials.make sets, as opposed to responses and subject info
+MADE_COLUMNS = ['block', 'block_type', 'proposition_id', 'feat_type',
+                'question_slug', 'cue', 'mask_type', 'response_type', 'pic',
+                'correct_response']
+
+
+def test_make_reproduces_collected_trials():
+    data = pd.read_csv('data/MDT101.csv').set_index('trial')
+    made = Trials.make(seed=101, cache=None).to_frame(categorical=False)
+    made = made.set_index('trial').loc[data.index]
+    for col in MADE_COLUMNS:
+        assert (made[col].fillna('').astype(str).tolist() ==
+                data[col].fillna('').astype(str).tolist()), col
+
+
+def test_factor_order_is_part_of_the_cache_key():
+    cache = StageCache()
+    reordered = OrderedDict(reversed(Trials.DEFAULTS['factors'].items()))
+    Trials.make(seed=101, factors=reordered, cache=cache)
+    cached = Trials.make(seed=101, cache=cache).to_frame(categorical=False)
+    uncached = Trials.make(seed=101, cache=None).to_frame(categorical=False)
+    assert cached.equals(uncached)
+
+
+def test_unseeded_trials_are_not_cached():
+    cache = StageCache()
+    Trials.make(cache=cache)
+    assert cache.hits == cache.misses == 0
+
+
+def made_frame():
+    return Trials.make(seed=101, cache=None).to_frame(categorical=False)
+
+
+def test_frame_round_trip():
+    frame = made_frame()
+    assert Trials.from_frame(frame).to_frame(categorical=False).equals(frame)
+    categorical = Trials.from_frame(frame).to_frame()
+    assert Trials.from_frame(categorical).to_frame(
+        categorical=False).equals(frame)
+
+
+def test_records_round_trip():
+    frame = made_frame()
+    trials = Trials(frame.to_dict('records'))
+    assert trials.to_frame(categorical=False)[frame.columns].equals(frame)
+
+
+def test_csv_round_trip(tmpdir):
+    trials = Trials.make(seed=101, cache=None)
+    trials[0]['rt'] = 512.5
+    trials_csv = str(tmpdir.join('trials.csv'))
+    trials.write_trials(trials_csv)
+    read = Trials.read_trials(trials_csv).to_frame(categorical=False)
+    made = trials.to_frame(categorical=False)
+    for col in Trials.COLUMNS:
+        assert read[col].fillna('').tolist() == made[col].fillna('').tolist()
+
+
+def test_trial_view_reads_and_writes():
+    frame = made_frame()
+    trials = Trials.from_frame(frame)
+    trial = trials[3]
+    assert dict(trial.items()) == {
+        col: '' if pd.isnull(value) else value
+        for col, value in frame.iloc[3].to_dict().items()}
+    assert trial['rt'] == ''
+    trial['rt'] = 512.3
+    trial['response'] = 'yes'
+    trial['is_correct'] = 1
+    assert trials[3]['rt'] == 512.3
+    assert trials[3]['response'] == 'yes'
+    assert trials[3]['is_correct'] == 1
+    assert trials[-1]['trial'] == len(trials) - 1
+    # Other trials are unchanged
+    assert trials[4]['response'] == ''
+
+
+def test_take_and_slice():
+    frame = made_frame()
+    trials = Trials.from_frame(frame)
+    subset = trials[10:20].to_frame(categorical=False)
+    assert subset.equals(frame.iloc[10:20].reset_index(drop=True))
+    taken = trials.take(np.array([5, 1, 5])).to_frame(categorical=False)
+    assert taken.equals(frame.iloc[[5, 1, 5]].reset_index(drop=True))
+
+
+def test_concat_merges_levels():
+    first = Trials.make(seed=101, cache=None)
+    second = Trials.make(seed=102, cache=None)
+    second[0]['response'] = 'yes'
+    combined = Trials.concat([first, second]).to_frame(categorical=False)
+    expected = pd.concat([first.to_frame(categorical=False),
+                          second.to_frame(categorical=False)],
+                         ignore_index=True)
+    assert combined.equals(expected)
+
+
+def test_encoded_marks_missing_numbers():
+    trials = Trials.make(seed=101, cache=None)
+    trials[2]['rt'] = 512.5
+    codes, levels = trials.encoded('rt')
+    assert levels == [512.5, '']
+    assert codes[2] == 0
+    assert (codes[np.arange(len(trials)) != 2] == 1).all()
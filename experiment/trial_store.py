@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+""" Store trials in a local SQLite database.
+
+The database is opened in WAL mode, so analysis scripts can read it while
+stations are writing. Trials are inserted in batches by a writer thread, and
+a trial is identified by (subj_id, trial), so writing it again replaces it.
+
+    >>> store = TrialStore('data/trials.sqlite')
+    >>> store.write_header(['subj_id', 'trial', 'rt'])
+    >>> store.write_trial({'subj_id': 'MDT146', 'trial': 0, 'rt': 512.3})
+    >>> store.close()
+    >>> store.subjects()
+    ['MDT146']
+    >>> store.export_csv('MDT146', 'data/MDT146.csv')
+"""
+import csv
+import sqlite3
+import threading
+from Queue import Queue, Empty
+
+import pandas as pd
+
+INDEXED_COLUMNS = ['subj_id', 'proposition_id', 'block']
+
+
+def _sql_value(value):
+    # sqlite3 can't bind numpy scalars
+    return getattr(value, 'item', lambda: value)()
+
+
+def connect(db_path):
+    """ Open a connection for reading while sessions are running. """
+    con = sqlite3.connect(db_path, timeout=30)
+    con.execute('PRAGMA journal_mode=WAL')
+    return con
+
+
+class TrialStore(object):
+    TABLE = 'trials'
+
+    def __init__(self, db_path, batch_size=20, flush_interval=1.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._col_names = None
+        self._queue = Queue()
+        self._writer = None
+
+    def write_header(self, col_names):
+        """ Create the table, adding any new columns, and start writing. """
+        # Queued rows are in the order of the previous header
+        self.close()
+        self._col_names = list(col_names)
+        con = connect(self.db_path)
+        with con:
+            con.execute('PRAGMA synchronous=NORMAL')
+            columns = ', '.join('"%s"' % col for col in self._col_names)
+            con.execute('CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY '
+                        '(subj_id, trial))'.format(self.TABLE, columns))
+            existing = [row[1] for row in
+                        con.execute('PRAGMA table_info(%s)' % self.TABLE)]
+            for col in self._col_names:
+                if col not in existing:
+                    con.execute('ALTER TABLE {} ADD COLUMN "{}"'.format(
+                        self.TABLE, col))
+            for col in INDEXED_COLUMNS:
+                if col in self._col_names:
+                    con.execute('CREATE INDEX IF NOT EXISTS {0}_{1} ON '
+                                '{0} ("{1}")'.format(self.TABLE, col))
+        con.close()
+
+        self._writer = threading.Thread(target=self._write_loop,
+                                        args=(self._col_names, ))
+        self._writer.daemon = True
+        self._writer.start()
+
+    def write_trial(self, trial_data):
+        """ Queue a dict of values for every column in the header. """
+        assert self._col_names, 'write header first to create the table'
+        row = [_sql_value(trial_data[col]) for col in self._col_names]
+        self._queue.put(row)
+
+    def close(self):
+        """ Write all queued trials and stop the writer thread. """
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def _write_loop(self, col_names):
+        con = connect(self.db_path)
+        insert = 'INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+            self.TABLE, ', '.join('"%s"' % col for col in col_names),
+            ', '.join('?' * len(col_names)))
+        done = False
+        while not done:
+            batch = []
+            try:
+                row = self._queue.get(timeout=self.flush_interval)
+                while row is not None:
+                    batch.append(row)
+                    if len(batch) >= self.batch_size:
+                        break
+                    row = self._queue.get_nowait()
+            except Empty:
+                pass
+            else:
+                done = row is None
+            if batch:
+                with con:
+                    con.executemany(insert, batch)
+        con.close()
+
+    def read(self, where=None, params=()):
+        """ Read trials into a DataFrame, e.g., where='subj_id = ?'. """
+        sql = 'SELECT * FROM %s' % self.TABLE
+        if where:
+            sql += ' WHERE ' + where
+        con = connect(self.db_path)
+        try:
+            return pd.read_sql_query(sql, con, params=params)
+        finally:
+            con.close()
+
+    def subjects(self):
+        con = connect(self.db_path)
+        try:
+            rows = con.execute('SELECT DISTINCT subj_id FROM %s ORDER BY '
+                               'subj_id' % self.TABLE).fetchall()
+        finally:
+            con.close()
+        return [row[0] for row in rows]
+
+    def export_csv(self, subj_id, csv_path):
+        """ Write one subject's trials in the same format as Participant. """
+        con = connect(self.db_path)
+        try:
+            cursor = con.execute('SELECT * FROM %s WHERE subj_id = ? '
+                                 'ORDER BY trial' % self.TABLE, (subj_id, ))
+            col_names = [col[0] for col in cursor.description]
+            with open(csv_path, 'wb') as f:
+                writer = csv.writer(f, lineterminator='\n')
+                writer.writerow(col_names)
+                writer.writerows(cursor)
+        finally:
+            con.close()
@@ -0,0 +1,511 @@
+#!/usr/bin/env python
+""" Trial lists, stored by column.
+
+Categorical columns are int16 codes into a list of levels, and numeric
+columns are float arrays with nan for missing values, so a trial list is a
+few kilobytes instead of a list of dicts. Indexing a Trials gives a
+TrialView, which reads and writes one row like a dict.
+
+    >>> trials = Trials.make(seed=101)
+    >>> trials[0]['cue']
+    'pig'
+    >>> trials[0]['rt'] = 512.3
+    >>> frame = trials.to_frame()   # categoricals stay as codes
+"""
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from unipath import Path
+
+from labtools.trials_functions import (counterbalance, expand, extend,
+                                       add_block, smart_shuffle)
+from labtools.profiling import profiler
+from labtools.stage_cache import StageCache, file_digest
+
+
+class TrialView(object):
+    """ One trial of a Trials, with dict-like access.
+
+    Setting a value writes it to the Trials. Missing values read as ''.
+    """
+    __slots__ = ('trials', 'index')
+
+    def __init__(self, trials, index):
+        self.trials = trials
+        self.index = index
+
+    def __getitem__(self, col):
+        return self.trials.get_value(self.index, col)
+
+    def __setitem__(self, col, value):
+        self.trials.set_value(self.index, col, value)
+
+    def __contains__(self, col):
+        return col in self.trials.columns
+
+    def __iter__(self):
+        return iter(self.trials.columns)
+
+    def __len__(self):
+        return len(self.trials.columns)
+
+    def keys(self):
+        return list(self.trials.columns)
+
+    def items(self):
+        return [(col, self[col]) for col in self.trials.columns]
+
+    def get(self, col, default=None):
+        return self[col] if col in self else default
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class Trials(object):
+    STIM_DIR = Path('stimuli')
+    COLUMNS = [
+        # Trial columns
+        'block',
+        'block_type',
+        'trial',
+
+        # Stimuli columns
+        'proposition_id',
+        'feat_type',
+        'question_slug',
+        'cue',
+        'mask_type',
+        'response_type',
+        'pic',
+        'correct_response',
+
+        # Response columns
+        'response',
+        'rt',
+        'is_correct',
+    ]
+    # Everything else is categorical. Integers are stored as floats so
+    # they can be missing.
+    INTEGER_COLUMNS = ['block', 'trial', 'is_correct']
+    FLOAT_COLUMNS = ['rt']
+    DEFAULTS = dict(
+        # counterbalance crosses factors in order, and the seeded draws
+        # depend on the order of the rows. This is the order the original
+        # {'feat_type': ..., 'mask_type': ...} literal iterated in.
+        factors=OrderedDict([('mask_type', ['mask', 'nomask']),
+                             ('feat_type', ['visual', 'nonvisual'])]),
+        ratio_yes_correct_responses=0.75,
+        ratio_prompt_response_type=0.75,
+        proposition_usage=None,
+        coverage_strength=1.0,
+        reps=4,
+        num_practice=8,
+        # The original practice draw is with replacement, so a practice
+        # trial can be shown twice. False draws without replacement, which
+        # changes the trials made for a seed.
+        practice_replace=True,
+        block_size=50,
+    )
+    CACHE = StageCache(cache_dir=os.environ.get('DUALVERIFICATION_CACHE'))
+
+    def __init__(self, records=None):
+        """ Store a list of trial dicts, e.g., from DataFrame.to_dict. """
+        self.columns = []
+        self._codes = {}    # categorical column -> int16 codes
+        self._levels = {}   # categorical column -> list of values
+        self._lookup = {}   # categorical column -> {value: code}, as needed
+        self._values = {}   # numeric column -> float64 values
+        self._length = 0
+        if records:
+            self._set_frame(pd.DataFrame.from_records(list(records)))
+
+    @classmethod
+    def from_frame(cls, frame):
+        trials = cls()
+        trials._set_frame(frame)
+        return trials
+
+    @classmethod
+    def from_codes(cls, columns, codes, levels):
+        """ Trials from a (trials, columns) array of codes into levels.
+
+        This is how trials are stored in session bundles.
+        """
+        trials = cls()
+        trials._length = len(codes)
+        for j, col in enumerate(columns):
+            col_levels = list(levels[col])
+            if trials._is_numeric(col):
+                numeric = np.array([np.nan if value == '' else value
+                                    for value in col_levels], dtype=float)
+                trials._values[col] = numeric[codes[:, j]]
+            else:
+                trials._codes[col] = codes[:, j].astype(np.int16)
+                trials._levels[col] = col_levels
+            trials.columns.append(col)
+        return trials
+
+    @classmethod
+    def read_trials(cls, trials_csv):
+        return cls.from_frame(pd.read_csv(trials_csv))
+
+    @classmethod
+    def concat(cls, trials_lists):
+        """ One Trials with the trials of many, merging their levels. """
+        trials_lists = list(trials_lists)
+        combined = cls()
+        combined._length = sum(len(trials) for trials in trials_lists)
+        for col in trials_lists[0].columns:
+            if cls._is_numeric(col):
+                combined._values[col] = np.concatenate(
+                    [trials._values[col] for trials in trials_lists])
+                combined.columns.append(col)
+                continue
+            levels, lookup, codes = [], {}, []
+            for trials in trials_lists:
+                for value in trials._levels[col]:
+                    if value not in lookup:
+                        lookup[value] = len(levels)
+                        levels.append(value)
+                recode = np.array([lookup[value]
+                                   for value in trials._levels[col]],
+                                  dtype=np.int16)
+                codes.append(recode[trials._codes[col]])
+            combined._codes[col] = np.concatenate(codes)
+            combined._levels[col] = levels
+            combined.columns.append(col)
+        return combined
+
+    @classmethod
+    def _is_numeric(cls, col):
+        return col in cls.INTEGER_COLUMNS or col in cls.FLOAT_COLUMNS
+
+    def _set_frame(self, frame):
+        self._length = len(frame)
+        for col in frame.columns:
+            values = frame[col]
+            if self._is_numeric(col):
+                values = values.replace('', np.nan)
+                self._values[col] = np.asarray(values, dtype=float)
+            elif str(values.dtype) == 'category':
+                self._codes[col] = np.asarray(values.cat.codes,
+                                              dtype=np.int16)
+                self._levels[col] = list(values.cat.categories)
+            else:
+                codes, levels = pd.factorize(values.fillna(''))
+                self._codes[col] = codes.astype(np.int16)
+                self._levels[col] = list(levels)
+            self.columns.append(col)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(np.arange(self._length)[index])
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('trial index out of range')
+        return TrialView(self, index)
+
+    def __iter__(self):
+        for index in xrange(self._length):
+            yield TrialView(self, index)
+
+    def get_value(self, index, col):
+        if col in self._codes:
+            return self._levels[col][self._codes[col][index]]
+        value = self._values[col][index]
+        if np.isnan(value):
+            return ''
+        return int(value) if col in self.INTEGER_COLUMNS else value
+
+    def set_value(self, index, col, value):
+        if col not in self.columns:
+            self._add_column(col)
+        if col in self._values:
+            self._values[col][index] = np.nan if value == '' else value
+            return
+        if col not in self._lookup:
+            self._lookup[col] = {level: code for code, level
+                                 in enumerate(self._levels[col])}
+        lookup = self._lookup[col]
+        if value not in lookup:
+            lookup[value] = len(self._levels[col])
+            self._levels[col].append(value)
+        self._codes[col][index] = lookup[value]
+
+    def _add_column(self, col):
+        if self._is_numeric(col):
+            self._values[col] = np.full(self._length, np.nan)
+        else:
+            self._codes[col] = np.zeros(self._length, dtype=np.int16)
+            self._levels[col] = ['']
+        self.columns.append(col)
+
+    def take(self, indices):
+        """ A new Trials with the trials at indices. """
+        subset = self.__class__()
+        subset._length = len(indices)
+        subset.columns = list(self.columns)
+        for col, codes in self._codes.items():
+            subset._codes[col] = codes[indices]
+            subset._levels[col] = list(self._levels[col])
+        for col, values in self._values.items():
+            subset._values[col] = values[indices]
+        return subset
+
+    def column(self, col):
+        """ Decoded values of one column as an array. """
+        if col in self._codes:
+            return np.array(self._levels[col], dtype=object)[self._codes[col]]
+        return self._values[col]
+
+    def encoded(self, col):
+        """ Codes and levels for a column. Missing numbers are ''. """
+        if col in self._codes:
+            return self._codes[col], list(self._levels[col])
+        values = self._values[col]
+        missing = np.isnan(values)
+        levels = np.unique(values[~missing]).tolist()
+        if col in self.INTEGER_COLUMNS:
+            levels = map(int, levels)
+        codes = np.searchsorted(levels, values).astype(np.int16)
+        if missing.any():
+            codes[missing] = len(levels)
+            levels.append('')
+        return codes, levels
+
+    def to_frame(self, categorical=True):
+        """ A DataFrame of the trials.
+
+        Categorical columns are pandas Categoricals built on the existing
+        codes, or decoded values if categorical is False.
+        """
+        data = {}
+        for col in self.columns:
+            if col in self._codes and categorical:
+                data[col] = pd.Categorical.from_codes(self._codes[col],
+                                                      self._levels[col])
+            elif col in self._codes:
+                data[col] = self.column(col)
+            elif col in self.INTEGER_COLUMNS:
+                values = self._values[col]
+                missing = np.isnan(values)
+                if not missing.any():
+                    values = values.astype(int)
+                elif not missing.all():
+                    values = values.astype(object)
+                    values[~missing] = values[~missing].astype(int)
+                data[col] = values
+            else:
+                data[col] = self._values[col]
+        return pd.DataFrame(data, columns=self.columns)
+
+    @classmethod
+    def propositions(cls):
+        """ Read the proposition info. """
+        propositions_csv = Path(cls.STIM_DIR, 'propositions.csv')
+        return pd.read_csv(propositions_csv)
+
+    @classmethod
+    def make(cls, **kwargs):
+        """ Create a list of trials.
+
+        Each trial has values for all keys in self.COLUMNS.
+
+        If proposition_usage (a PropositionUsage) is given, propositions
+        that have been shown to fewer participants are more likely to be
+        selected. Propositions still never repeat within a participant.
+
+        Each stage is cached in cls.CACHE (pass cache=None to skip it),
+        keyed by the settings it uses, propositions.csv and the seed.
+        Trials made without a seed aren't cached.
+        """
+        settings = dict(cls.DEFAULTS)
+        settings.update(kwargs)
+        cache = settings.pop('cache', cls.CACHE)
+
+        seed = settings.get('seed')
+        if seed is None:
+            # Unseeded lists are meant to differ every time
+            cache = None
+
+        def run_stage(name, func, **depends_on):
+            if cache is None:
+                return None, func()
+            key = cache.key(name, **depends_on)
+            return key, cache.get(key, func)
+
+        usage = settings['proposition_usage']
+        usage_counts = None if usage is None else sorted(usage.counts.items())
+
+        # The skeleton doesn't depend on the seed
+        with profiler.stage('skeleton'):
+            skeleton_key, skeleton = run_stage(
+                'skeleton', lambda: cls.make_skeleton(settings),
+                # Pairs, since the key's json sorts dict keys
+                factors=OrderedDict(settings['factors']).items(),
+                ratio_yes=settings['ratio_yes_correct_responses'],
+                ratio_prompt=settings['ratio_prompt_response_type'],
+                reps=settings['reps'])
+
+        propositions_csv = Path(cls.STIM_DIR, 'propositions.csv')
+        with profiler.stage('assign_propositions'):
+            assign_key, (trials, practice_trials) = run_stage(
+                'assign',
+                lambda: cls._assign_propositions(skeleton, settings),
+                skeleton=skeleton_key, seed=seed,
+                propositions=file_digest(propositions_csv),
+                num_practice=settings['num_practice'],
+                practice_replace=settings['practice_replace'],
+                usage=usage_counts,
+                coverage_strength=settings['coverage_strength'])
+
+        # Finishing touches
+        with profiler.stage('add_block'):
+            block_key, trials = run_stage(
+                'add_block',
+                lambda: add_block(trials, settings['block_size'],
+                                  name='block', start=1, groupby='cue',
+                                  seed=seed),
+                assign=assign_key, block_size=settings['block_size'])
+        with profiler.stage('smart_shuffle'):
+            _, trials = run_stage(
+                'smart_shuffle',
+                lambda: smart_shuffle(trials, col='cue', block='block',
+                                      seed=seed),
+                add_block=block_key)
+        trials['block_type'] = 'test'
+
+        # Merge practice trials
+        trials = pd.concat([practice_trials, trials])
+
+        # Label trial
+        trials['trial'] = range(len(trials))
+
+        # Reorcder columns
+        trials = trials[cls.COLUMNS]
+
+        return cls.from_frame(trials)
+
+    @staticmethod
+    def make_skeleton(settings):
+        """ Balance within subject variables.
+
+        settings['factors'] is an OrderedDict or a list of (factor, levels)
+        pairs. Their order sets the order of the rows, so it's part of the
+        design. expand only uses a seed when sampling, which make doesn't do, so
+        the skeleton is the same for every seed.
+        """
+        with profiler.stage('counterbalance'):
+            # counterbalance modifies the dict it's given
+            trials = counterbalance(OrderedDict(settings['factors']))
+        with profiler.stage('expand'):
+            trials = expand(trials, name='correct_response',
+                            values=['yes', 'no'],
+                            ratio=settings['ratio_yes_correct_responses'])
+            trials = expand(trials, name='response_type',
+                            values=['prompt', 'pic'],
+                            ratio=settings['ratio_prompt_response_type'])
+
+            # Extend the trials to final length
+            trials = extend(trials, reps=settings['reps'])
+        return trials
+
+    @classmethod
+    def _assign_propositions(cls, trials, settings):
+        """ Add cues, propositions and pics, and split off practice trials.
+
+        All of the seeded choices in make that aren't made by a
+        trials_functions primitive are made here, in their original order.
+        """
+        seed = settings.get('seed')
+        prng = pd.np.random.RandomState(seed)
+        usage = settings['proposition_usage']
+
+        # Read proposition info
+        propositions = cls.propositions()
+
+        # Add cue
+        categories = propositions.cue.unique()
+        trials['cue'] = prng.choice(categories, len(trials), replace=True)
+
+        _propositions = propositions.copy()
+
+        def determine_question(row):
+            is_cue = (_propositions.cue == row['cue'])
+            is_feat_type = (_propositions.feat_type == row['feat_type'])
+            is_correct_response = (_propositions.correct_response ==
+                                   row['correct_response'])
+
+            valid_propositions = (is_cue & is_feat_type & is_correct_response)
+
+            if valid_propositions.sum() == 0:
+                trials.ix[row.name, 'cue'] = prng.choice(categories)
+                return determine_question(trials.ix[row.name, ])
+
+            options = _propositions.ix[valid_propositions, ]
+            if usage is None:
+                selected_ix = prng.choice(options.index)
+            else:
+                p = usage.weights(options.proposition_id,
+                                  settings['coverage_strength'])
+                selected_ix = prng.choice(options.index, p=p)
+            selected_proposition_id = options.ix[selected_ix, 'proposition_id']
+            _propositions.drop(selected_ix, inplace=True)
+
+            return selected_proposition_id
+
+        trials['proposition_id'] = trials.apply(determine_question, axis=1)
+
+        # Merge in question
+        trials = trials.merge(propositions)
+
+        # Add in picture
+        def determine_pic(row):
+            if row['response_type'] != 'pic':
+                return ''
+            elif row['correct_response'] == 'yes':
+                return row['cue']
+            else:
+                distractors = list(categories)
+                distractors.remove(row['cue'])
+                return prng.choice(distractors)
+
+        trials['pic'] = trials.apply(determine_pic, axis=1)
+
+        # Add columns for response variables
+        for col in ['response', 'rt', 'is_correct']:
+            trials[col] = ''
+
+        # Add practice trials
+        practice_ix = prng.choice(trials.index, settings['num_practice'],
+                                  replace=settings['practice_replace'])
+        practice_trials = trials.ix[practice_ix, ]
+        practice_trials['block'] = 0
+        practice_trials['block_type'] = 'practice'
+        trials.drop(practice_ix, inplace=True)
+
+        return trials, practice_trials
+
+    def write_trials(self, trials_csv):
+        trials = self.to_frame()
+        trials = trials[self.COLUMNS]
+        trials.to_csv(trials_csv, index=False)
+
+    def iter_blocks(self, key='block'):
+        """ Yield blocks of trials. """
+        block = self[0][key]
+        trials_in_block = []
+        for trial in self:
+            if trial[key] == block:
+                trials_in_block.append(trial)
+            else:
+                yield trials_in_block
+                block = trial[key]
+                trials_in_block = []